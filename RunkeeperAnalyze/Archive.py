@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Archive of run summaries, with queries over time windows
+
+    An Archive holds the RunSummary (see Batch) of every run, i.e. of every
+    track of every gpx file, in a table with one array per column (see
+    ARCHIVE_COLUMNS), sorted by start time. It is filled by analyzing gpx
+    files in parallel (see Batch.analyze), and updated incrementally: only
+    new files, and files whose modification time or size have changed, are
+    analyzed. Files and tracks that could not be analyzed are listed in
+    errors.
+
+    Queries select runs by start time and distance, and sum the columns over
+    days, weeks (starting on Monday), months or years, in UTC. They only use
+    array operations on the table: no gpx file is read and no distance is
+    calculated. An archive can be saved to a file and loaded again.
+"""
+
+import os
+import time
+import cPickle as pickle
+import numpy as np
+
+from RunkeeperAnalyze import Distance
+from RunkeeperAnalyze.Batch import analyze, gpx_files
+from RunkeeperAnalyze.GPX_Parser import PREF_DUNIT, TIMES, DISTANCE
+from RunkeeperAnalyze.RunData import WALKING_SPEED, PAUSE_TIME
+
+# columns of the table, taken from the RunSummary of every run
+ARCHIVE_COLUMNS = ('track', 'start_time', 'total_time', 'active_time',
+                   'total_distance', 'active_distance', 'elevation_gain',
+                   'segments', 'points')
+
+# columns holding integers; all others hold floats
+INTEGER_COLUMNS = ('track', 'segments', 'points')
+
+# columns that are summed up by Archive.totals
+TOTAL_COLUMNS = ('total_time', 'active_time', 'total_distance',
+                 'active_distance', 'elevation_gain')
+
+WINDOWS = ('day', 'week', 'month', 'year')
+
+# Identifies the layout of saved archives
+FORMAT_VERSION = 2
+
+
+def window_start(timestamps, window):
+    """ Return array of the timestamps of the beginning of the day, week,
+        month or year (in UTC) containing each of the given timestamps
+    """
+    days = np.floor(np.asarray(timestamps, dtype=float)
+                    / TIMES['day']).astype(np.int64)
+    if window == 'day':
+        pass
+    elif window == 'week':
+        days -= (days + 3) % 7 # 1970-01-01 was a Thursday
+    elif window == 'month' or window == 'year':
+        days = days.astype('datetime64[D]').astype(
+               'datetime64[%s]' % window[0].upper()).astype(
+               'datetime64[D]').astype(np.int64)
+    else:
+        raise ValueError("window must be one of %s" % ", ".join(WINDOWS))
+    return days * TIMES['day']
+
+
+class Totals(object):
+    """ Class holding the sums of the summaries of all runs in one time
+        window, which begins at the timestamp start. runs is the number of
+        runs; times are in seconds, distances in meters.
+    """
+    __slots__ = ('start', 'runs') + TOTAL_COLUMNS
+    def __init__(self, start, runs, total_time, active_time, total_distance,
+                 active_distance, elevation_gain):
+        self.start = start
+        self.runs = runs
+        self.total_time = total_time
+        self.active_time = active_time
+        self.total_distance = total_distance
+        self.active_distance = active_distance
+        self.elevation_gain = elevation_gain
+    def __str__(self):
+        return "%s: %i runs, %.3f km in %.1f min active, %.0f m up" % (
+               time.strftime("%Y-%m-%d", time.gmtime(self.start)), self.runs,
+               self.active_distance / 1000, self.active_time / 60,
+               self.elevation_gain)
+    def pace(self, tunit='min', dunit=PREF_DUNIT):
+        """ Return the average pace over the active distance in tunit/dunit,
+            or None if there is no active distance
+        """
+        if self.active_distance == 0:
+            return None
+        return (self.active_time / TIMES[tunit]) \
+               / (self.active_distance / DISTANCE[dunit])
+
+
+class Archive(object):
+    """ Table of the summaries of many runs (see module documentation)
+
+        filenames is an array with the filename of every run, and columns
+        maps the names in ARCHIVE_COLUMNS to arrays of the same length; the
+        column 'track' holds the number of the track of every run in its
+        file. errors maps the filenames of all files that could not be
+        analyzed, or that have tracks that could not be analyzed, to the
+        error messages. The arguments are passed to Batch.analyze for all
+        updates.
+    """
+    def __init__(self, segmentize=True, walking_speed=WALKING_SPEED,
+                 pause_time=PAUSE_TIME, model=None):
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        self.segmentize = segmentize
+        self.walking_speed = walking_speed
+        self.pause_time = pause_time
+        self.model = model
+        self.filenames = np.zeros(0, dtype=object)
+        self.columns = dict((name, np.zeros(0, dtype=(int if name in
+                             INTEGER_COLUMNS else float)))
+                            for name in ARCHIVE_COLUMNS)
+        self.errors = {}
+        self._stat = {} # filename -> (mtime, size) when it was analyzed
+    def __len__(self):
+        return len(self.filenames)
+    def __getitem__(self, name):
+        """ Return the column with the given name """
+        return self.columns[name]
+    def update(self, path, processes=None, chunksize=1):
+        """ Analyze all gpx files in the given directory or matching the
+            given glob pattern (or in the given list of filenames) that are
+            new or have changed since the last update, and return their
+            number. All runs of a file are replaced together. Runs of files
+            that are not given are kept.
+        """
+        if isinstance(path, basestring):
+            filenames = gpx_files(path)
+        else:
+            filenames = list(path)
+        stat = {}
+        for filename in filenames:
+            info = os.stat(filename)
+            stat[filename] = (info.st_mtime, info.st_size)
+        changed = [filename for filename in filenames
+                   if self._stat.get(filename) != stat[filename]]
+        if not changed:
+            return 0
+        summaries = list(analyze(changed, processes, chunksize,
+                                 self.segmentize, self.walking_speed,
+                                 self.pause_time, self.model))
+        self.remove(changed)
+        for summary in summaries:
+            self._stat[summary.filename] = stat[summary.filename]
+            if summary.error is not None:
+                error = summary.error
+                if summary.track is not None:
+                    error = "track %i: %s" % (summary.track, error)
+                if summary.filename in self.errors:
+                    error = "%s; %s" % (self.errors[summary.filename], error)
+                self.errors[summary.filename] = error
+        summaries = [summary for summary in summaries
+                     if summary.error is None]
+        filenames = np.concatenate((self.filenames,
+                    np.array([summary.filename for summary in summaries],
+                             dtype=object)))
+        columns = dict((name, np.concatenate((self.columns[name],
+                        [getattr(summary, name) for summary in summaries])))
+                       for name in ARCHIVE_COLUMNS)
+        order = np.argsort(columns['start_time'], kind='mergesort')
+        self.filenames = filenames[order]
+        self.columns = dict((name, column[order])
+                            for (name, column) in columns.items())
+        return len(changed)
+    def remove(self, filenames):
+        """ Remove the runs of the given files from the archive """
+        filenames = set(filenames)
+        keep = np.array([filename not in filenames
+                         for filename in self.filenames], dtype=bool)
+        self.filenames = self.filenames[keep]
+        self.columns = dict((name, column[keep])
+                            for (name, column) in self.columns.items())
+        for filename in filenames:
+            self.errors.pop(filename, None)
+            self._stat.pop(filename, None)
+    def select(self, start=None, end=None, min_distance=None,
+               max_distance=None, unit='meter'):
+        """ Return a boolean array selecting all runs that started at or
+            after the timestamp start and before the timestamp end, and whose
+            active distance (in the given unit) is between min_distance and
+            max_distance. Limits that are None are ignored. Selections can be
+            combined with & and |.
+        """
+        selection = np.ones(len(self), dtype=bool)
+        start_time = self.columns['start_time']
+        distance = self.columns['active_distance'] / DISTANCE[unit]
+        if start is not None:
+            selection &= start_time >= start
+        if end is not None:
+            selection &= start_time < end
+        if min_distance is not None:
+            selection &= distance >= min_distance
+        if max_distance is not None:
+            selection &= distance <= max_distance
+        return selection
+    def totals(self, window='week', selection=None):
+        """ Return a list of Totals instances, one for every day, week, month
+            or year in which at least one of the selected runs (default: all
+            runs) started, in chronological order
+        """
+        if selection is None:
+            selection = np.ones(len(self), dtype=bool)
+        starts = window_start(self.columns['start_time'][selection], window)
+        starts, inverse = np.unique(starts, return_inverse=True)
+        runs = np.bincount(inverse, minlength=len(starts))
+        sums = [np.bincount(inverse, self.columns[name][selection],
+                            len(starts)) for name in TOTAL_COLUMNS]
+        return [Totals(int(start), int(count), *[float(column[i])
+                                                 for column in sums])
+                for (i, (start, count)) in enumerate(zip(starts, runs))]
+    def pace_trend(self, selection=None, tunit='min', dunit=PREF_DUNIT):
+        """ Return the change of the average pace of the selected runs
+            (default: all runs) per day, in tunit/dunit, from a least squares
+            fit weighted by the active distance of every run. Return None if
+            there are fewer than two runs with an active distance.
+        """
+        if selection is None:
+            selection = np.ones(len(self), dtype=bool)
+        distance = self.columns['active_distance'][selection]
+        moving = distance > 0
+        if np.count_nonzero(moving) < 2:
+            return None
+        distance = distance[moving]
+        days = self.columns['start_time'][selection][moving] / TIMES['day']
+        pace = (self.columns['active_time'][selection][moving]
+                / TIMES[tunit]) / (distance / DISTANCE[dunit])
+        if np.ptp(days) == 0:
+            return None
+        return float(np.polyfit(days - days.mean(), pace, 1,
+                                w=np.sqrt(distance))[0])
+    def save(self, filename):
+        """ Write the archive to the given file """
+        state = dict(self.__dict__)
+        archive_file = open(filename, 'wb')
+        try:
+            pickle.dump((FORMAT_VERSION, state), archive_file,
+                        pickle.HIGHEST_PROTOCOL)
+        finally:
+            archive_file.close()
+    @classmethod
+    def load(cls, filename):
+        """ Return the archive stored in the given file (see save) """
+        archive_file = open(filename, 'rb')
+        try:
+            version, state = pickle.load(archive_file)
+        finally:
+            archive_file.close()
+        if version != FORMAT_VERSION:
+            raise ValueError("%s: archive format %s is not supported"
+                             % (filename, version))
+        archive = cls.__new__(cls)
+        archive.__dict__.update(state)
+        return archive
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Analysis of many gpx files in parallel """
+
+import os
+import glob
+import itertools
+import multiprocessing
+import numpy as np
+
+from RunkeeperAnalyze import Distance
+from RunkeeperAnalyze.RunData import read_runs, WALKING_SPEED, PAUSE_TIME
+
+
+class RunSummary(object):
+    """ Class holding the summary of a single run, i.e. of one track of a gpx
+        file. Times are in seconds, distances in meters. elevation_gain is
+        the sum of all climbs inside the segments, without any smoothing. If
+        the run could not be analyzed, error contains the error message, and
+        all other attributes except filename and track are None. track is
+        also None if the file could not be read at all.
+    """
+    __slots__ = ('filename', 'track', 'start_time', 'total_time',
+                 'active_time', 'total_distance', 'active_distance',
+                 'elevation_gain', 'segments', 'points', 'error')
+    def __init__(self, filename, track=0, start_time=None, total_time=None,
+                 active_time=None, total_distance=None, active_distance=None,
+                 elevation_gain=None, segments=None, points=None,
+                 error=None):
+        self.filename = filename
+        self.track = track
+        self.start_time = start_time
+        self.total_time = total_time
+        self.active_time = active_time
+        self.total_distance = total_distance
+        self.active_distance = active_distance
+        self.elevation_gain = elevation_gain
+        self.segments = segments
+        self.points = points
+        self.error = error
+    def __str__(self):
+        name = self.filename
+        if self.track:
+            name = "%s (track %i)" % (self.filename, self.track)
+        if self.error is not None:
+            return "%s: %s" % (name, self.error)
+        return "%s: %.3f km in %.1f min (%.1f min active), %i segments" % (
+               name, self.total_distance / 1000,
+               self.total_time / 60, self.active_time / 60, self.segments)
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def summarize(filename, segmentize=True, walking_speed=WALKING_SPEED,
+              pause_time=PAUSE_TIME, model=None):
+    """ Return a list with a RunSummary for every track of the given gpx file
+        (see summarize_run). The file is read only once. If it cannot be
+        read, or has no tracks, the list holds a single summary with the
+        error. Errors are reported in the summaries instead of being raised.
+    """
+    try:
+        runs = list(read_runs(filename))
+        if not runs:
+            raise ValueError("no tracks")
+    except Exception, error:
+        return [RunSummary(filename, track=None, error="%s: %s"
+                           % (error.__class__.__name__, error))]
+    return [summarize_run(run, track, segmentize, walking_speed, pause_time,
+                          model)
+            for (track, run) in enumerate(runs)]
+
+
+def summarize_run(run, track=0, segmentize=True, walking_speed=WALKING_SPEED,
+                  pause_time=PAUSE_TIME, model=None):
+    """ Return a RunSummary for the given Run, read from the given track of
+        its file. If segmentize is True, the run is segmentized first, and
+        empty segments are dropped. Any error is reported in the summary
+        instead of being raised.
+    """
+    try:
+        if segmentize:
+            run.segmentize(walking_speed, pause_time, model)
+        run.segments = [segment for segment in run.segments
+                        if len(segment.trackpoints) > 0]
+        if not run.segments:
+            raise ValueError("no trackpoints")
+        return RunSummary(run.filename, track,
+                   start_time=run.segments[0].timestamp[0],
+                   total_time=run.total_time(),
+                   active_time=run.active_time(unit='sec'),
+                   total_distance=run.total_distance(model=model),
+                   active_distance=run.active_distance(model=model),
+                   elevation_gain=sum(float(np.maximum(np.diff(
+                                      segment.elevation), 0).sum())
+                                      for segment in run.segments),
+                   segments=len(run.segments),
+                   points=sum(len(segment.trackpoints)
+                              for segment in run.segments))
+    except Exception, error:
+        return RunSummary(run.filename, track, error="%s: %s"
+                          % (error.__class__.__name__, error))
+
+
+def _summarize(args):
+    """ Wrapper around summarize taking a tuple of arguments """
+    return summarize(*args)
+
+
+def gpx_files(path):
+    """ Return the sorted list of gpx files in the given directory, or
+        matching the given glob pattern
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.gpx')
+    return sorted(glob.glob(path))
+
+
+def analyze(path, processes=None, chunksize=1, segmentize=True,
+            walking_speed=WALKING_SPEED, pause_time=PAUSE_TIME, model=None):
+    """ Generator for the RunSummary of every track of every gpx file in the
+        given directory or matching the given glob pattern (see gpx_files).
+        Instead of a path, a list of filenames may be given.
+
+        The files are analyzed by a pool of the given number of worker
+        processes (default: number of CPUs), which receive chunksize files at
+        a time. The summaries of a file are yielded together, in the order of
+        the tracks, and files in the order in which they are completed. A
+        file or track that cannot be analyzed results in a summary with an
+        error message (see summarize). If processes is 1, all files are
+        analyzed in the current process.
+    """
+    if isinstance(path, basestring):
+        filenames = gpx_files(path)
+    else:
+        filenames = list(path)
+    if model is None:
+        # the workers may not share the DISTANCE_MODEL of this process
+        model = Distance.DISTANCE_MODEL
+    tasks = [(filename, segmentize, walking_speed, pause_time, model)
+             for filename in filenames]
+    if processes == 1:
+        for summaries in itertools.imap(_summarize, tasks):
+            for summary in summaries:
+                yield summary
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for summaries in pool.imap_unordered(_summarize, tasks, chunksize):
+            for summary in summaries:
+                yield summary
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
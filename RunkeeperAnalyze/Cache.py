@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" On-disk cache of parsed gpx files
+
+    Every parsed file is stored as three .npy files in the cache directory,
+    named after the SHA-1 hash of the content of the gpx file and the
+    FORMAT_VERSION: the data array of shape (4, n), the segment offsets and
+    the track offsets, as returned by GPX_Parser.read_columns().
+    Cached data is loaded memory-mapped (copy-on-write), so no data is read
+    until it is used, and modifying it does not change the cache.
+
+    For every gpx file, a small index entry in the subdirectory
+    INDEX_DIRECTORY (named after the SHA-1 hash of the path of the file)
+    holds its modification time, size and hash, so that the hash of an
+    unchanged file does not have to be recalculated. A file that has changed
+    is hashed again; if the content is still the same, the cached data is
+    used. Since every entry is a file of its own, adding an entry costs the
+    same for any number of cached files, and processes sharing the cache
+    never overwrite each other's entries.
+
+    The cache is used by Run if TRACK_CACHE is set to a TrackCache instance
+    (see RunData.read_index).
+"""
+
+import os
+import errno
+import hashlib
+import tempfile
+import cPickle as pickle
+import numpy as np
+
+# Cache used by Run.__init__, if not None
+TRACK_CACHE = None
+
+# Identifies the layout and the interpretation of the cached data. Cached
+# data of a different version is ignored.
+FORMAT_VERSION = 3
+
+INDEX_DIRECTORY = 'index'
+
+
+def file_hash(filename):
+    """ Return the SHA-1 hex digest of the content of the given file """
+    sha1 = hashlib.sha1()
+    gpx_file = open(filename, 'rb')
+    try:
+        while True:
+            block = gpx_file.read(1 << 20)
+            if not block:
+                break
+            sha1.update(block)
+    finally:
+        gpx_file.close()
+    return sha1.hexdigest()
+
+
+class TrackCache(object):
+    """ Cache of parsed gpx files in the given directory, holding at most
+        max_size bytes (None for no limit). If the cache grows beyond
+        max_size, the least recently used entries are removed.
+
+        Several processes can use the same cache directory. All files are
+        written to a temporary file first and then renamed, so other
+        processes never see incomplete data.
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(os.path.join(directory, INDEX_DIRECTORY))
+        except OSError, error:
+            if error.errno != errno.EEXIST:
+                raise
+        self._index = {} # index entries read or written by this instance
+    def _entry_name(self, path):
+        """ Return the name of the index entry (relative to the cache
+            directory) for the given absolute path of a gpx file
+        """
+        return os.path.join(INDEX_DIRECTORY, hashlib.sha1(path).hexdigest())
+    def _read_entry(self, path):
+        """ Return the index entry (mtime, size, hash) for the given absolute
+            path of a gpx file, or None if there is none
+        """
+        try:
+            entry_file = open(os.path.join(self.directory,
+                                           self._entry_name(path)), 'rb')
+        except IOError:
+            return None
+        try:
+            entry_path, mtime, size, content_hash = pickle.load(entry_file)
+        except Exception:
+            return None # a damaged entry only costs the hash
+        finally:
+            entry_file.close()
+        if entry_path != path:
+            return None
+        return mtime, size, content_hash
+    def _write_entry(self, path, entry):
+        """ Store the index entry (mtime, size, hash) for the given absolute
+            path of a gpx file
+        """
+        self._index[path] = entry
+        self._write_file(self._entry_name(path),
+            lambda entry_file: pickle.dump((path,) + entry, entry_file,
+                                           pickle.HIGHEST_PROTOCOL))
+    def _write_file(self, name, write):
+        """ Atomically create the file with the given name in the cache
+            directory, by calling write with a file object
+        """
+        handle, tmp_name = tempfile.mkstemp(dir=self.directory,
+                                            suffix='.tmp')
+        try:
+            tmp_file = os.fdopen(handle, 'wb')
+            try:
+                write(tmp_file)
+            finally:
+                tmp_file.close()
+            os.rename(tmp_name, os.path.join(self.directory, name))
+        except:
+            os.remove(tmp_name)
+            raise
+    def _paths(self, key):
+        """ Return paths of the data file, segment offsets file and track
+            offsets file for the given key
+        """
+        base = os.path.join(self.directory, key)
+        return (base + '.data.npy', base + '.segments.npy',
+                base + '.tracks.npy')
+    def _key(self, filename, update_index=True):
+        """ Return the key for the given gpx file, consisting of the content
+            hash and the FORMAT_VERSION
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        entry = self._index.get(path)
+        if entry is None or entry[:2] != (stat.st_mtime, stat.st_size):
+            entry = self._read_entry(path) # may be from another process
+        if entry is not None and entry[:2] == (stat.st_mtime, stat.st_size):
+            content_hash = entry[2]
+        else:
+            content_hash = file_hash(path)
+            if update_index:
+                self._write_entry(path, (stat.st_mtime, stat.st_size,
+                                         content_hash))
+        return "%s-%i" % (content_hash, FORMAT_VERSION)
+    def load(self, filename):
+        """ Return a tuple (data, segment_offsets, track_offsets) for the
+            given gpx file (see GPX_Parser.read_columns), or None if the file
+            is not in the cache
+        """
+        data_path, segments_path, tracks_path \
+            = self._paths(self._key(filename))
+        try:
+            segment_offsets = np.load(segments_path)
+            track_offsets = np.load(tracks_path)
+            data = np.load(data_path, mmap_mode='c')
+        except IOError:
+            return None
+        try:
+            os.utime(data_path, None) # for LRU eviction
+        except OSError:
+            pass
+        return data, segment_offsets, track_offsets
+    def store(self, filename, data, segment_offsets, track_offsets):
+        """ Store the data and offsets of the given gpx file """
+        data_path, segments_path, tracks_path \
+            = self._paths(self._key(filename))
+        for path, offsets in ((segments_path, segment_offsets),
+                              (tracks_path, track_offsets)):
+            self._write_file(os.path.basename(path),
+                             lambda npy_file: np.save(npy_file,
+                                                      np.asarray(offsets)))
+        self._write_file(os.path.basename(data_path),
+                         lambda npy_file: np.save(npy_file,
+                                                  np.ascontiguousarray(data)))
+        if self.max_size is not None:
+            self.evict(self.max_size)
+    def invalidate(self, filename):
+        """ Remove the cached data of the given gpx file. Return True if
+            there was any.
+        """
+        path = os.path.abspath(filename)
+        keys = set()
+        entry = self._read_entry(path) or self._index.get(path)
+        self._index.pop(path, None)
+        if entry is not None:
+            keys.add("%s-%i" % (entry[2], FORMAT_VERSION))
+            try:
+                os.remove(os.path.join(self.directory,
+                                       self._entry_name(path)))
+            except OSError:
+                pass
+        if os.path.isfile(path):
+            keys.add(self._key(path, update_index=False))
+        removed = False
+        for key in keys:
+            removed = self._remove(key) or removed
+        return removed
+    def _remove(self, key):
+        """ Remove the cached data for the given key, return True if there
+            was any
+        """
+        removed = False
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+                removed = True
+            except OSError:
+                pass
+        return removed
+    def _entries(self):
+        """ Return list of tuples (last use, size in bytes, key) for all
+            entries in the cache
+        """
+        entries = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            key = name.split('.')[0]
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue # removed by another process
+            last_use, size = entries.get(key, (0, 0))
+            entries[key] = (max(last_use, stat.st_mtime), size + stat.st_size)
+        return [(last_use, size, key)
+                for (key, (last_use, size)) in entries.items()]
+    def size(self):
+        """ Return the total size of the cached data in bytes """
+        return sum(size for (last_use, size, key) in self._entries())
+    def evict(self, max_size):
+        """ Remove the least recently used entries until the cached data
+            takes at most max_size bytes
+        """
+        entries = sorted(self._entries())
+        total = sum(size for (last_use, size, key) in entries)
+        for last_use, size, key in entries:
+            if total <= max_size:
+                break
+            self._remove(key)
+            total -= size
+    def clear(self):
+        """ Remove all cached data and the index """
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                os.remove(os.path.join(self.directory, name))
+        index_directory = os.path.join(self.directory, INDEX_DIRECTORY)
+        for name in os.listdir(index_directory):
+            os.remove(os.path.join(index_directory, name))
+        self._index = {}
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Distance calculations working on whole arrays of coordinates
+
+    vincenty() iterates the Vincenty formula for all pairs of points at once,
+    until lambda has converged for every pair. Its results agree with
+    Trackpoint.distance_to to 1e-7 m absolute (on the order of nanometers
+    for steps below 1 km), i.e. to a relative tolerance of 1e-8 for steps of
+    1 m or more, including the corrections for points at the poles and for
+    antipodal points. Relative differences for shorter steps are larger,
+    since the rounding error of either version does not shrink with the
+    step. On tracks with 10000 points, step_distances() is about 50 times
+    faster than calling Trackpoint.distance_to for every pair of points.
+"""
+
+import numpy as np
+
+# http://www.movable-type.co.uk/scripts/latlong-vincenty.html
+EARTH_MAJOR_AXIS = 6378388
+EARTH_MINOR_AXIS = 6356911.946
+
+# radius of the sphere used by the spherical models (mean radius)
+EARTH_RADIUS = (2 * EARTH_MAJOR_AXIS + EARTH_MINOR_AXIS) / 3.0
+
+MAX_ITERATIONS = 50 # after this, points are considered antipodal
+
+# If not None, called with the number of Vincenty iterations of every
+# calculation: an array from the kernel, an int from Trackpoint.distance_to
+# (used by Profiling)
+ITERATION_COUNTER = None
+
+# Model used for all distance calculations, unless a model is given
+# explicitly. For steps between 1 m and 1 km, 'haversine' deviates from
+# 'vincenty' by up to 0.57% (the earth is not a sphere), 'equirectangular'
+# agrees with 'haversine' to 5e-9; see examples/compare_distance_models.py
+DISTANCE_MODEL = 'vincenty'
+
+
+def distances(lat1, lon1, lat2, lon2, model=None):
+    """ Return an array of the distances in meters between the points
+        (lat1, lon1) and (lat2, lon2), calculated with the given model (one
+        of the keys of MODELS, default DISTANCE_MODEL)
+    """
+    if model is None:
+        model = DISTANCE_MODEL
+    return MODELS[model](lat1, lon1, lat2, lon2)
+
+
+def vincenty(lat1, lon1, lat2, lon2):
+    """ Return an array of the distances in meters between the points
+        (lat1, lon1) and (lat2, lon2) on the surface of the earth ellipsoid.
+        All coordinates are given in degrees, as arrays of the same shape.
+    """
+    return _vincenty(lat1, lon1, lat2, lon2)[0]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ Return an array of the great-circle distances in meters between the
+        points (lat1, lon1) and (lat2, lon2) on a sphere with EARTH_RADIUS
+    """
+    lat1 = np.asarray(lat1, dtype=float) * 0.0174532925199433
+    lon1 = np.asarray(lon1, dtype=float) * 0.0174532925199433
+    lat2 = np.asarray(lat2, dtype=float) * 0.0174532925199433
+    lon2 = np.asarray(lon2, dtype=float) * 0.0174532925199433
+    h = (   np.sin((lat2 - lat1) / 2)**2
+          + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2 )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def equirectangular(lat1, lon1, lat2, lon2):
+    """ Return an array of the distances in meters between the points
+        (lat1, lon1) and (lat2, lon2), in a local equirectangular projection
+        around the midpoint of each pair of points. This is only accurate for
+        points close to each other, not too close to the poles.
+    """
+    lat1 = np.asarray(lat1, dtype=float) * 0.0174532925199433
+    lon1 = np.asarray(lon1, dtype=float) * 0.0174532925199433
+    lat2 = np.asarray(lat2, dtype=float) * 0.0174532925199433
+    lon2 = np.asarray(lon2, dtype=float) * 0.0174532925199433
+    dlon = (lon2 - lon1 + np.pi) % (2 * np.pi) - np.pi # across 180 degrees
+    x = dlon * np.cos((lat1 + lat2) / 2)
+    y = lat2 - lat1
+    return EARTH_RADIUS * np.sqrt(x**2 + y**2)
+
+
+MODELS = {'vincenty': vincenty, 'haversine': haversine,
+          'equirectangular': equirectangular}
+
+
+def step_distances(latitude, longitude, elevation=None, model=None):
+    """ Return an array of the distances in meters between all consecutive
+        points of a track, calculated with the given model (default
+        DISTANCE_MODEL). If elevation is given, the elevation difference
+        between the points is taken into account.
+    """
+    if model is None:
+        model = DISTANCE_MODEL
+    if model == 'vincenty':
+        sinU, cosU, lon = _prepare(latitude, longitude)
+        result = _inverse(sinU[1:], cosU[1:], lon[1:],
+                          sinU[:-1], cosU[:-1], lon[:-1])[0]
+    else:
+        latitude = np.asarray(latitude, dtype=float)
+        longitude = np.asarray(longitude, dtype=float)
+        result = MODELS[model](latitude[1:], longitude[1:],
+                               latitude[:-1], longitude[:-1])
+    if elevation is not None:
+        elevation = np.asarray(elevation, dtype=float)
+        result = np.sqrt(result**2 + np.diff(elevation)**2)
+    return result
+
+
+def cartesian(latitude, longitude):
+    """ Return array of shape (3, n) of the cartesian coordinates in meters of
+        the given points on a sphere with radius EARTH_MAJOR_AXIS. Like the
+        distance models, latitudes beyond the poles are taken as the poles.
+    """
+    lat = np.clip(latitude, -90.0, 90.0) * 0.0174532925199433
+    lon = np.asarray(longitude, dtype=float) * 0.0174532925199433
+    return EARTH_MAJOR_AXIS * np.array([np.cos(lat) * np.cos(lon),
+                                        np.cos(lat) * np.sin(lon),
+                                        np.sin(lat)])
+
+
+def _vincenty(lat1, lon1, lat2, lon2):
+    """ Return a tuple (distances, iterations), where iterations is the
+        number of iterations of the Vincenty formula for every pair of points
+        (MAX_ITERATIONS + 1 if it did not converge), the same number that
+        Trackpoint.distance_to needs
+    """
+    return _inverse(*(_prepare(lat1, lon1) + _prepare(lat2, lon2)))
+
+
+def _prepare(latitude, longitude):
+    """ Return a tuple (sinU, cosU, lon) of the sine and cosine of the reduced
+        latitude and of the longitude in radians (in [0, 2 pi]), for the given
+        latitude and longitude in degrees.
+    """
+    f = float(EARTH_MAJOR_AXIS - EARTH_MINOR_AXIS) / EARTH_MAJOR_AXIS
+    # convert coordinates to radians
+    lat = np.asarray(latitude, dtype=float) * 0.0174532925199433
+    lon = np.asarray(longitude, dtype=float) * 0.0174532925199433
+    # correct for errors at exact poles by adjusting 0.6 millimeters:
+    lat = np.clip(lat, -(np.pi / 2.0 - 1e-10), np.pi / 2.0 - 1e-10)
+    # sin(U) and cos(U) are obtained from tan(U) directly
+    tanU = (1-f) * np.tan(lat)
+    cosU = 1 / np.sqrt(1 + tanU**2)
+    if np.all(np.abs(lon) < 2 * np.pi):
+        # same result as the modulo operation, but much faster
+        lon = np.where(lon < 0, lon + 2 * np.pi, lon)
+    else:
+        lon = lon % (2 * np.pi)
+    return tanU * cosU, cosU, lon
+
+
+def _inverse(sinU1, cosU1, lon1, sinU2, cosU2, lon2):
+    """ Solve the inverse geodesic problem for the prepared coordinates (see
+        _prepare), return tuple (distances, iterations). This is an
+        element-wise version of the algorithm in Trackpoint.distance_to:
+        lambda is iterated until it changes by less than 1e-12, and only the
+        pairs of points that have not converged yet take part in the next
+        iteration. iterations is the number of iterations for every pair of
+        points, MAX_ITERATIONS + 1 for pairs that did not converge and are
+        taken as antipodal. It is also passed to ITERATION_COUNTER.
+    """
+    a = EARTH_MAJOR_AXIS
+    b = EARTH_MINOR_AXIS
+    f = float(a-b)/a
+    arrays = np.broadcast_arrays(sinU1, cosU1, lon1, sinU2, cosU2, lon2)
+    shape = arrays[0].shape
+    sinU1, cosU1, lon1, sinU2, cosU2, lon2 \
+        = [np.ravel(array) for array in arrays]
+    L = np.abs(lon2 - lon1)
+    L = np.where(L > np.pi, 2*np.pi - L, L)
+    sinU1sinU2 = sinU1*sinU2
+    cosU1cosU2 = cosU1*cosU2
+    cosU1sinU2 = cosU1*sinU2
+    sinU1cosU2 = sinU1*cosU2
+    # values of the last iteration for every pair of points
+    lambda_v = L.copy()
+    sigma = np.zeros(L.shape)
+    sin_sigma = np.zeros(L.shape)
+    cos_sigma = np.zeros(L.shape)
+    cos2alpha = np.zeros(L.shape)
+    cos2sigmam = np.zeros(L.shape)
+    iterations = np.zeros(L.shape, dtype=int)
+    active = slice(None) # pairs of points that have not converged yet
+    for iteration in xrange(1, MAX_ITERATIONS + 1):
+        lambda_old = lambda_v[active]
+        sinL = np.sin(lambda_old)
+        if np.all(lambda_old < np.pi / 4):
+            cosL = np.sqrt(1 - sinL**2) # faster than cos, and accurate here
+        else:
+            cosL = np.cos(lambda_old)
+        sinsigma = np.sqrt(   (cosU2[active]*sinL)**2
+                            + (cosU1sinU2[active]
+                               - sinU1cosU2[active]*cosL)**2 )
+        cossigma = sinU1sinU2[active] + cosU1cosU2[active]*cosL
+        sigma_ = np.arctan2(sinsigma, cossigma)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm = np.sqrt(sinsigma**2 + cossigma**2)
+            sin_sigma_ = sinsigma / norm
+            cos_sigma_ = cossigma / norm
+            # for (nearly) antipodal points, the result is sensitive to
+            # rounding errors; follow the scalar version exactly there
+            exact = (cossigma < 0.0) | (norm == 0.0)
+            if np.any(exact):
+                sin_sigma_ = np.where(exact, np.sin(sigma_), sin_sigma_)
+                cos_sigma_ = np.where(exact, np.cos(sigma_), cos_sigma_)
+            sinalpha = np.clip(cosU1cosU2[active]*sinL / sin_sigma_,
+                               -1.0, 1.0)
+            sinalpha = np.where(sin_sigma_ == 0.0, 0.0, sinalpha)
+            cos2alpha_ = 1 - sinalpha**2
+            cos2sigmam_ = cos_sigma_ - 2*sinU1sinU2[active] / cos2alpha_
+            cos2sigmam_ = np.where(cos2alpha_ == 0.0, 0.0, cos2sigmam_)
+        C = f/16 * cos2alpha_ * (4 + f * (4-3*cos2alpha_))
+        lambda_new = L[active] + (1-C) * f * sinalpha * ( sigma_+C*sin_sigma_
+                     * (cos2sigmam_+C*cos_sigma_*(-1+2*cos2sigmam_**2)) )
+        sigma[active] = sigma_
+        sin_sigma[active] = sin_sigma_
+        cos_sigma[active] = cos_sigma_
+        cos2alpha[active] = cos2alpha_
+        cos2sigmam[active] = cos2sigmam_
+        iterations[active] = iteration
+        # points are essentially antipodal if lambda > pi
+        antipodal = lambda_new > np.pi
+        remaining = np.flatnonzero(~antipodal & (np.abs(lambda_new
+                                                        - lambda_old)
+                                                 >= 1e-12))
+        lambda_v[active] = np.where(antipodal, np.pi, lambda_new)
+        if isinstance(active, slice):
+            active = remaining
+        else:
+            active = active[remaining]
+        if len(active) == 0:
+            break
+    else:
+        # no convergence: points are essentially antipodal
+        iterations[active] = MAX_ITERATIONS + 1
+    u2 = cos2alpha * (a**2-b**2) / b**2
+    A = 1 + u2/16384 * ( 4096 + u2*(-768 + u2*(320-175*u2)) )
+    B = u2 / 1024 * ( 256 + u2*(-128 + u2*(74-47*u2)) )
+    deltasigma = B * sin_sigma * (
+                 cos2sigmam+B/4*(cos_sigma *(-1+2*cos2sigmam**2)
+                 - B/6 * cos2sigmam * (-3 + 4*sin_sigma**2)
+                   * (-3+4*cos2sigmam**2))  )
+    if ITERATION_COUNTER is not None:
+        ITERATION_COUNTER(iterations)
+    return ((b * A * (sigma-deltasigma)).reshape(shape),
+            iterations.reshape(shape))
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Export of analyzed runs as tables with one row per trackpoint
+
+    Every run is written as a table with the columns in EXPORT_COLUMNS, all
+    computed with array operations. The step distance, step time, speed and
+    pace refer to the previous trackpoint in the same segment; they are zero
+    for the first trackpoint of every segment. The cumulative distance is the
+    active distance (see Splits.active_track). Distances are in meters, times
+    in seconds, speeds in m/s and paces in s/m. Empty segments are not
+    exported.
+
+    Two formats are supported, both written one run at a time, so that any
+    number of runs can be streamed into a file:
+
+    * binary: for every run, two arrays in .npy format: a header with the
+      filename of the run and the distance model, and the table as a float
+      array of shape (len(EXPORT_COLUMNS), n), i.e. one contiguous row per
+      column.
+    * csv: a comment line '# run: model filename' with the distance model
+      and the filename of the run, and the rows of the table for every run,
+      after a single header line with the column names.
+
+    The readers rebuild Run objects directly from the tables. Their segments
+    are views on the table data, and the step distances from the table are
+    stored in the cache of the segments.
+"""
+
+import numpy as np
+
+from RunkeeperAnalyze import Distance
+from RunkeeperAnalyze.RunData import Run, Segment
+from RunkeeperAnalyze.Splits import active_track
+
+EXPORT_COLUMNS = ('segment', 'latitude', 'longitude', 'elevation',
+                  'timestamp', 'step_distance', 'step_time', 'speed', 'pace',
+                  'cumulative_distance')
+SEGMENT, LATITUDE, LONGITUDE, ELEVATION, TIMESTAMP, STEP_DISTANCE, \
+STEP_TIME, SPEED, PACE, CUMULATIVE_DISTANCE = range(len(EXPORT_COLUMNS))
+
+CSV_FORMATS = ('%d', '%.15g', '%.15g', '%.15g', '%.15g', '%.10g', '%.10g',
+               '%.10g', '%.10g', '%.10g')
+
+
+def table(run, model=None):
+    """ Return an array of shape (len(EXPORT_COLUMNS), n) with the export
+        table of the given run, using the given distance model (default
+        Distance.DISTANCE_MODEL)
+    """
+    segments = [segment for segment in run.segments
+                if len(segment.trackpoints) > 0]
+    sizes = [len(segment.trackpoints) for segment in segments]
+    n = sum(sizes)
+    result = np.zeros((len(EXPORT_COLUMNS), n))
+    if n == 0:
+        return result
+    result[SEGMENT] = np.repeat(np.arange(len(sizes)), sizes)
+    result[LATITUDE:TIMESTAMP+1] = np.concatenate([segment.data
+                                                   for segment in segments],
+                                                  axis=1)
+    first = np.zeros(n, dtype=bool) # first trackpoint of every segment
+    first[np.cumsum([0] + sizes[:-1])] = True
+    result[STEP_DISTANCE, ~first] = np.concatenate(
+        [segment.step_distances(model=model) for segment in segments])
+    result[STEP_TIME, 1:] = np.abs(np.diff(result[TIMESTAMP]))
+    result[STEP_TIME, first] = 0.0
+    result[CUMULATIVE_DISTANCE] = active_track(run, model)[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = result[STEP_DISTANCE] / result[STEP_TIME]
+        pace = result[STEP_TIME] / result[STEP_DISTANCE]
+    result[SPEED] = np.where(result[STEP_TIME] > 0, speed, 0.0)
+    result[PACE] = np.where(result[STEP_DISTANCE] > 0, pace, 0.0)
+    return result
+
+
+def write_binary(runs, filename, model=None):
+    """ Write the export tables of all the given runs (any iterable) into a
+        binary file. Return the number of rows written.
+    """
+    if model is None:
+        model = Distance.DISTANCE_MODEL
+    rows = 0
+    out = open(filename, 'wb')
+    try:
+        for run in runs:
+            data = table(run, model)
+            np.save(out, np.array([run.filename or '', model]))
+            np.save(out, data)
+            rows += data.shape[1]
+    finally:
+        out.close()
+    return rows
+
+
+def read_binary(filename):
+    """ Generator for the Run objects in the given binary export file """
+    infile = open(filename, 'rb')
+    try:
+        while True:
+            if infile.read(1) == '':
+                return # end of file
+            infile.seek(-1, 1)
+            name, model = np.load(infile)
+            yield _run(np.load(infile), str(name) or None, str(model))
+    finally:
+        infile.close()
+
+
+def write_csv(runs, filename, model=None):
+    """ Write the export tables of all the given runs (any iterable) into a
+        csv file. Return the number of rows written.
+    """
+    if model is None:
+        model = Distance.DISTANCE_MODEL
+    row_format = ",".join(CSV_FORMATS) + "\n"
+    rows = 0
+    out = open(filename, 'w')
+    try:
+        out.write(",".join(EXPORT_COLUMNS) + "\n")
+        for run in runs:
+            data = table(run, model)
+            out.write(("# run: %s %s" % (model, run.filename or '')).rstrip()
+                      + "\n")
+            # all rows are formatted by a single % operation
+            out.write((row_format * data.shape[1])
+                      % tuple(data.T.ravel().tolist()))
+            rows += data.shape[1]
+    finally:
+        out.close()
+    return rows
+
+
+def read_csv(filename, model=None):
+    """ Generator for the Run objects in the given csv export file. The step
+        distances are taken to be calculated with the model given for every
+        run in the file. For files that do not give it, the given model
+        (default Distance.DISTANCE_MODEL) is used.
+    """
+    if model is None:
+        model = Distance.DISTANCE_MODEL
+    infile = open(filename)
+    try:
+        infile.readline() # header
+        name = None
+        lines = []
+        for line in infile:
+            if line.startswith('# run:'):
+                if name is not None:
+                    yield _run(_parse_csv(lines, filename), name, run_model)
+                run_model, name = _parse_run_line(line, model)
+                lines = []
+            else:
+                lines.append(line)
+        if name is not None:
+            yield _run(_parse_csv(lines, filename), name, run_model)
+    finally:
+        infile.close()
+
+
+def _parse_run_line(line, model):
+    """ Return tuple (model, name) for the given '# run:' line of a csv file.
+        The given model is returned if the line does not start with one of
+        the keys of Distance.MODELS.
+    """
+    text = line[len('# run:'):].strip()
+    fields = text.split(' ', 1) + ['']
+    if fields[0] in Distance.MODELS:
+        return fields[0], fields[1]
+    return model, text
+
+
+def _parse_csv(lines, filename):
+    """ Return the export table for the given csv lines of a run, read from
+        the given file. Raise ValueError for lines that are not numeric
+        tables with the EXPORT_COLUMNS.
+    """
+    values = np.fromstring(",".join(lines), sep=',')
+    if len(values) != len(lines) * len(EXPORT_COLUMNS):
+        raise ValueError("%s: invalid csv table" % filename)
+    return values.reshape(len(lines), len(EXPORT_COLUMNS)).T
+
+
+def _run(data, name, model):
+    """ Return a Run rebuilt from the given export table """
+    run = Run()
+    run.filename = name or None
+    boundaries = np.flatnonzero(np.diff(data[SEGMENT])) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [data.shape[1]]))
+    for start, end in zip(starts, ends):
+        if end == start:
+            continue
+        segment = Segment(data[LATITUDE:TIMESTAMP+1, start:end])
+        segment._cache[('step', True, model)] \
+            = data[STEP_DISTANCE, start+1:end]
+        run.segments.append(segment)
+    return run
@@ -21,13 +21,14 @@
 
 """ Parser for getting Trackpoints from Runkeeper GPX data """
 
-from xml.dom import minidom
+import xml.etree.cElementTree as ElementTree
+import re
 import time
+import calendar
+import numpy as np
 from math import pi, sin, cos, tan, atan, sqrt, asin, atan2
-
-# http://www.movable-type.co.uk/scripts/latlong-vincenty.html
-EARTH_MAJOR_AXIS = 6378388
-EARTH_MINOR_AXIS = 6356911.946
+from RunkeeperAnalyze import Distance
+from RunkeeperAnalyze.Distance import EARTH_MAJOR_AXIS, EARTH_MINOR_AXIS
 
 DISTANCE = {'m' : 1, 'meter' : 1, 'km' : 1000, 'miles' : 1609.344,
             'mile': 1609.344}
@@ -36,8 +37,9 @@ TIMES = {'s' : 1, 'sec': 1, 'min': 60, 'hour': 3600, 'day' : 86400}
 PREF_DUNIT = 'km' # set this to 'miles' if you're in the US
 
 
-class Trackpoint:
+class Trackpoint(object):
     """ Class representing a single track point """
+    __slots__ = ('latitude', 'longitude', 'timestamp', 'elevation')
     def __init__(self, latitude=0, longitude=0, timestamp=0, elevation=0):
         self.latitude = latitude
         self.longitude = longitude
@@ -83,8 +85,29 @@ class Trackpoint:
             return (DISTANCE[dunit] * time_diff) / (TIMES[tunit] * dist_diff )
         except ZeroDivisionError:
             return 0.0
-    def distance_to(self, trackpoint, use_elevation=True, unit='meter'):
-        """ Calculate the distance to another trackpoint """
+    def distance_to(self, trackpoint, use_elevation=True, unit='meter',
+                    model=None):
+        """ Calculate the distance to another trackpoint, using the given
+            distance model (one of the keys of Distance.MODELS, default
+            Distance.DISTANCE_MODEL)
+        """
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        if model == 'vincenty':
+            distance = self._vincenty_distance_to(trackpoint)
+        else:
+            distance = float(Distance.MODELS[model](
+                             self.latitude, self.longitude,
+                             trackpoint.latitude, trackpoint.longitude))
+        if use_elevation:
+            height_diff = self.elevation - trackpoint.elevation
+            return sqrt( distance**2 + height_diff**2 ) / DISTANCE[unit]
+        else:
+            return distance / DISTANCE[unit]
+    def _vincenty_distance_to(self, trackpoint):
+        """ Calculate the distance to another trackpoint on the surface of the
+            earth ellipsoid, in meters
+        """
         # adapted from
         # http://www.mathworks.com/matlabcentral/fileexchange/5379
         a = EARTH_MAJOR_AXIS
@@ -139,8 +162,10 @@ class Trackpoint:
                 # slightly.
                 lambda_v = pi
                 break
-            if abs(lambda_v-lambdaold) > 1e-12:
+            if abs(lambda_v-lambdaold) < 1e-12:
                 break
+        if Distance.ITERATION_COUNTER is not None:
+            Distance.ITERATION_COUNTER(itercount)
         u2 = cos(alpha)**2 * (a**2-b**2) / b**2
         A = 1 + u2/16384 * ( 4096 + u2*(-768 + u2*(320-175*u2)) )
         B = u2 / 1024 * ( 256 + u2*(-128 + u2*(74-47*u2)) )
@@ -148,12 +173,7 @@ class Trackpoint:
                      cos2sigmam+B/4*(cos(sigma) *(-1+2*cos2sigmam**2) \
                      - B/6 * cos2sigmam * (-3 + 4*sin(sigma)**2) \
                        * (-3+4*cos2sigmam**2))  )
-        if use_elevation:
-            height_diff = self.elevation - trackpoint.elevation
-            return sqrt( (b * A * (sigma-deltasigma))**2
-                         + height_diff**2 ) / DISTANCE[unit]
-        else:
-            return b * A * (sigma-deltasigma) / DISTANCE[unit]
+        return b * A * (sigma-deltasigma)
 
 
 class GPX_Error(ValueError):
@@ -162,91 +182,352 @@ class GPX_Error(ValueError):
 
 
 class GPX_Parser:
-    """ Class for parsing a gpx file """
-    def __init__(self, filename):
-        self.xmldoc = minidom.parse(filename)
+    """ Class for parsing a single track of a gpx file (default: the first
+        one). Iterating over the parser yields the trackpoints of the next
+        segment.
+
+        The file is read incrementally: trackpoints are produced as the
+        corresponding XML elements are completed, and consumed elements are
+        discarded immediately. The memory used by the parser therefore does
+        not depend on the size of the file. For random access to all tracks
+        and segments, use GPX_Index.
+    """
+    def __init__(self, filename, track=0):
+        self.filename = filename
+        self.track = track
         self._done = False
+        self._segments_done = 0
+        self._number_of_segments = None
+        self._events = _trackpoint_events(filename, track)
+        self._pending = None
         try:
-            self.xmldoc = self.xmldoc.firstChild
-            if self.xmldoc.nodeName != 'gpx':
-                raise GPX_Error("root node is not 'gpx'")
-        except IndexError:
-            raise GPX_Error("XML file does not contain a root node")
-        for child in self.xmldoc.childNodes:
-            if child.nodeName == 'trk':
-                self._curnode = child
-                break
-        for child in self._curnode.childNodes:
-            if child.nodeName == 'trkseg':
-                self._curnode = child
-                break
+            self._pending = self._events.next()
+        except StopIteration:
+            self._done = True
     def __iter__(self):
         return self
     def number_of_segments(self):
         """ Return number of segments that are still available to be iterated
             over
+
+            The segments are counted in a separate pass over the file, which
+            only looks for the ends of segments: trackpoints are not decoded,
+            and nothing is kept in memory. To read and count all segments in
+            a single pass, use GPX_Index.
         """
-        curnode = self._curnode
-        while curnode.nodeName != 'trkseg':
-            curnode = curnode.parentNode
-        result = 0
-        while curnode is not None:
-            if curnode.nodeName == 'trkseg':
-                result = result + 1
-            curnode = curnode.nextSibling
-        return result
+        if self._number_of_segments is None:
+            self._number_of_segments = 0
+            for event, item in _track_events(self.filename):
+                if event == 'endseg' and item == self.track:
+                    self._number_of_segments += 1
+                elif event == 'endtrk' and item == self.track:
+                    break
+        return self._number_of_segments - self._segments_done
     def next(self):
         """ Return the next trackpoint """
         if self._done:
             raise StopIteration
-        if self._curnode.nodeName == 'trkpt':
-            next_node = self._curnode.nextSibling
-            while next_node.nodeName != 'trkpt':
-                next_node = next_node.nextSibling
-                if next_node is None:
-                    next_node = self._curnode.parentNode
-                    if (next_node.nodeName != 'trkseg'):
-                        raise GPX_Error("Expected to trkseg node")
-                    # go to beginning of next segment
-                    next_node = next_node.nextSibling
-                    while next_node.nodeName != 'trkseg':
-                        next_node = next_node.nextSibling
-                        if next_node is None:
-                            self._done = True
-                            raise StopIteration # eof
-                    self._curnode = next_node
-                    raise StopIteration # end of segment
-            self._curnode = next_node
-            return self._process_trkpt()
-        elif self._curnode.nodeName == 'trkseg':
-            next_node = self._curnode.firstChild
-            while next_node.nodeName != 'trkpt':
-                next_node = next_node.nextSibling
-                if next_node is None:
-                    raise StopIteration # eof
-            self._curnode = next_node
-            return self._process_trkpt()
-        else:
-            raise GPX_Error("Unexpected status")
-    def _process_trkpt(self):
-        """ Return a Trackpoint instance generated from self._curnode, which
-            must be a trkpt node
+        event, item = self._pending
+        try:
+            self._pending = self._events.next()
+        except StopIteration:
+            self._done = True
+        if event == 'trkpt':
+            return item
+        else: # end of segment
+            self._segments_done += 1
+            raise StopIteration
+
+
+class GPX_Index(object):
+    """ Class holding the trackpoints of all tracks in a gpx file, read in a
+        single pass (see read_columns), with an index of all tracks and
+        segments
+
+        data is an array of shape (4, n), with rows for latitude, longitude,
+        elevation and timestamp. Segment i consists of the columns
+        segment_offsets[i]:segment_offsets[i+1] of data, and track j of the
+        segments track_offsets[j]:track_offsets[j+1].
+    """
+    def __init__(self, filename, columns=None):
+        """ Read the given gpx file, unless the tuple (data, segment_offsets,
+            track_offsets) is given as columns
+        """
+        self.filename = filename
+        if columns is None:
+            columns = read_columns(filename)
+        self.data, self.segment_offsets, self.track_offsets = columns
+    def number_of_tracks(self):
+        """ Return the number of tracks in the file """
+        return len(self.track_offsets) - 1
+    def number_of_segments(self, track=None):
+        """ Return the number of segments in the given track, or in the whole
+            file
         """
-        result = Trackpoint(latitude=float(self._curnode.getAttribute('lat')),
-                            longitude=float(self._curnode.getAttribute('lon')))
-        for trkpt_data in self._curnode.childNodes:
-            if trkpt_data.nodeName == 'ele':
-                elevation = ''
-                for text_data in trkpt_data.childNodes:
-                    if text_data.nodeType == text_data.TEXT_NODE:
-                        elevation = elevation + text_data.nodeValue
-                result.elevation = float(elevation)
-            if trkpt_data.nodeName == 'time':
-                time_string = ''
-                for text_data in trkpt_data.childNodes:
-                    if text_data.nodeType == text_data.TEXT_NODE:
-                        time_string = time_string + text_data.nodeValue
-                time_string = time_string.strip()
-                result.timestamp = time.mktime(time.strptime(time_string,
-                                   "%Y-%m-%dT%H:%M:%SZ"))
-        return result
+        if track is None:
+            return len(self.segment_offsets) - 1
+        self._check_track(track)
+        return int(self.track_offsets[track+1] - self.track_offsets[track])
+    def number_of_trackpoints(self, track=None):
+        """ Return the number of trackpoints in the given track, or in the
+            whole file
+        """
+        if track is None:
+            return self.data.shape[1]
+        self._check_track(track)
+        return int(self.segment_offsets[self.track_offsets[track+1]]
+                   - self.segment_offsets[self.track_offsets[track]])
+    def _check_track(self, track):
+        """ Raise IndexError if the given track does not exist """
+        if not 0 <= track < self.number_of_tracks():
+            raise IndexError("%s has no track %s" % (self.filename, track))
+    def segment_data(self, track, segment):
+        """ Return a view on the columns of data for the given segment of the
+            given track
+        """
+        if not 0 <= segment < self.number_of_segments(track):
+            raise IndexError("track %s of %s has no segment %s"
+                             % (track, self.filename, segment))
+        i = self.track_offsets[track] + segment
+        return self.data[:, self.segment_offsets[i]:self.segment_offsets[i+1]]
+    def trackpoints(self, track, segment):
+        """ Return list of Trackpoint instances for the given segment of the
+            given track
+        """
+        latitude, longitude, elevation, timestamp \
+            = self.segment_data(track, segment).tolist()
+        return [Trackpoint(*values) for values
+                in zip(latitude, longitude, timestamp, elevation)]
+
+
+def read_columns(filename):
+    """ Read all tracks in the given gpx file in a single pass. Return a
+        tuple (data, segment_offsets, track_offsets) of arrays, as described
+        for GPX_Index.
+    """
+    values = []
+    time_strings = [] # converted all at once by parse_times
+    segment_offsets = [0]
+    track_offsets = [0]
+    for event, item in _track_events(filename):
+        if event == 'trkpt':
+            latitude, longitude, elevation, time_string = _trkpt_fields(item)
+            values.append((latitude, longitude, elevation))
+            time_strings.append(time_string or _NO_TIME)
+        elif event == 'endseg':
+            segment_offsets.append(len(values))
+        else: # end of track
+            track_offsets.append(len(segment_offsets) - 1)
+    data = np.empty((4, len(values)))
+    data[:3] = np.array(values, dtype=float).reshape(-1, 3).T
+    data[3] = parse_times(time_strings)
+    return data, np.array(segment_offsets), np.array(track_offsets)
+
+
+def _local_name(tag):
+    """ Return the given element tag stripped of its namespace """
+    return tag[tag.rfind('}')+1:]
+
+
+def _track_events(filename):
+    """ Generator for the content of all tracks in the given gpx file.
+
+        Yields tuples ('trkpt', element) for every trkpt element, ('endseg',
+        track) at the end of every track segment, and ('endtrk', track) at
+        the end of every track, where track is the number of the track.
+        Every element is removed from the tree as soon as it has been
+        processed.
+    """
+    stack = []
+    track = -1
+    in_track = False
+    for event, element in ElementTree.iterparse(filename,
+                                                events=('start', 'end')):
+        if event == 'start':
+            if not stack:
+                if _local_name(element.tag) != 'gpx':
+                    raise GPX_Error("root node is not 'gpx'")
+            elif len(stack) == 1 and _local_name(element.tag) == 'trk':
+                in_track = True
+                track += 1
+            stack.append(element)
+            continue
+        stack.pop()
+        depth = len(stack)
+        if in_track:
+            if depth == 3 and _local_name(element.tag) == 'trkpt':
+                yield 'trkpt', element
+            elif depth == 2 and _local_name(element.tag) == 'trkseg':
+                yield 'endseg', track
+            elif depth == 1:
+                in_track = False
+                yield 'endtrk', track
+        if 0 < depth <= 3:
+            # elements below trkpt are released together with their trkpt
+            stack[-1].remove(element)
+
+
+def _trackpoint_events(filename, track=0):
+    """ Generator for the content of the given track in the given gpx file.
+
+        Yields tuples ('trkpt', Trackpoint) for every trackpoint and
+        ('endseg', None) at the end of every track segment.
+    """
+    current = 0 # number of the track the events belong to
+    for event, item in _track_events(filename):
+        if event == 'endtrk':
+            if item == track:
+                return # the rest of the file is not needed
+            current = item + 1
+        elif current == track:
+            if event == 'trkpt':
+                yield 'trkpt', _process_trkpt(item)
+            else:
+                yield 'endseg', None
+
+
+def _process_trkpt(element):
+    """ Return a Trackpoint instance generated from the given trkpt element
+    """
+    latitude, longitude, elevation, timestamp = _trkpt_values(element)
+    return Trackpoint(latitude, longitude, timestamp, elevation)
+
+
+def _trkpt_values(element):
+    """ Return tuple (latitude, longitude, elevation, timestamp) for the given
+        trkpt element
+    """
+    latitude, longitude, elevation, time_string = _trkpt_fields(element)
+    timestamp = 0
+    if time_string is not None:
+        timestamp = parse_time(time_string)
+    return latitude, longitude, elevation, timestamp
+
+
+def _trkpt_fields(element):
+    """ Return tuple (latitude, longitude, elevation, time_string) for the
+        given trkpt element; time_string is None if the trackpoint has no
+        time
+    """
+    elevation = 0
+    time_string = None
+    for trkpt_data in element:
+        if _local_name(trkpt_data.tag) == 'ele':
+            elevation = float(trkpt_data.text)
+        if _local_name(trkpt_data.tag) == 'time':
+            time_string = trkpt_data.text.strip()
+    return (float(element.get('lat')), float(element.get('lon')),
+            elevation, time_string)
+
+
+# epoch of midnight UTC for every date string 'YYYY-MM-DD' seen so far
+_date_cache = {}
+
+# time of trackpoints without a time element, for parse_times (timestamp 0)
+_NO_TIME = '1970-01-01T00:00:00Z'
+
+# positions of the separators and digits in 'YYYY-MM-DDTHH:MM:SSZ'
+_LAYOUT_POSITIONS = [4, 7, 10, 13, 16, 19]
+_LAYOUT_CHARS = np.array([ord(char) for char in '--T::Z'], dtype=np.uint8)
+_DIGIT_POSITIONS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+
+_TIME_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):'
+                           r'(\d{2}(?:\.\d*)?)(Z|[+-]\d{2}(?::?\d{2})?)?$')
+
+
+def _midnight(date_string):
+    """ Return the epoch of midnight UTC of the given date 'YYYY-MM-DD' """
+    try:
+        return _date_cache[date_string]
+    except KeyError:
+        if len(_date_cache) > 10000:
+            _date_cache.clear()
+        year, month, day = [int(part) for part in date_string.split('-')]
+        if not (1 <= month <= 12
+                and 1 <= day <= calendar.monthrange(year, month)[1]):
+            raise ValueError("invalid date: '%s'" % date_string)
+        midnight = calendar.timegm((year, month, day, 0, 0, 0))
+        _date_cache[date_string] = midnight
+        return midnight
+
+
+def _time_of_day(hour, minute, second):
+    """ Return the seconds since midnight for the given time of day (second
+        may be a float, and 60 for leap seconds)
+    """
+    if not (0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second < 61):
+        raise ValueError("invalid time of day: %s:%s:%s"
+                         % (hour, minute, second))
+    return 3600 * hour + 60 * minute + second
+
+
+def parse_time(time_string):
+    """ Return the seconds since the epoch for the given ISO 8601 time
+        string, e.g. '2010-07-24T19:33:25Z'. Fractional seconds and offsets
+        like '+02:00' are supported; times without offset are taken as UTC.
+    """
+    if len(time_string) == 20 and time_string[19] == 'Z' \
+    and time_string[10] == 'T':
+        # fast path for the layout used by Runkeeper
+        try:
+            return float(_midnight(time_string[:10])
+                         + _time_of_day(int(time_string[11:13]),
+                                        int(time_string[14:16]),
+                                        int(time_string[17:19])))
+        except ValueError:
+            pass # invalid times are reported below
+    match = _TIME_PATTERN.match(time_string)
+    if match is None:
+        raise GPX_Error("invalid time: '%s'" % time_string)
+    year, month, day, hour, minute, second, offset = match.groups()
+    try:
+        result = _midnight("%s-%s-%s" % (year, month, day)) \
+                 + _time_of_day(int(hour), int(minute), float(second))
+    except ValueError:
+        raise GPX_Error("invalid time: '%s'" % time_string)
+    if offset is not None and offset != 'Z':
+        sign = 1
+        if offset[0] == '-':
+            sign = -1
+        offset = offset[1:].replace(':', '')
+        result -= sign * (3600 * int(offset[:2]) + 60 * int(offset[2:] or 0))
+    return result
+
+
+def parse_times(time_strings):
+    """ Return an array of the seconds since the epoch for all the given
+        time strings (see parse_time). Strings in the layout used by
+        Runkeeper, 'YYYY-MM-DDTHH:MM:SSZ', are converted with array
+        operations; all other strings are passed to parse_time.
+    """
+    time_strings = list(time_strings)
+    result = np.zeros(len(time_strings))
+    try:
+        strings = np.array(time_strings, dtype='S')
+    except UnicodeError:
+        strings = np.zeros(0, dtype='S')
+    fast = np.zeros(len(time_strings), dtype=bool)
+    if len(strings) > 0 and strings.dtype.itemsize >= 20:
+        chars = strings.view(np.uint8).reshape(len(strings), -1)
+        digits = chars[:, :20].astype(int) - ord('0')
+        fast = np.all(chars[:, _LAYOUT_POSITIONS] == _LAYOUT_CHARS, axis=1)
+        fast &= np.all((digits[:, _DIGIT_POSITIONS] >= 0)
+                       & (digits[:, _DIGIT_POSITIONS] <= 9), axis=1)
+        if chars.shape[1] > 20:
+            fast &= chars[:, 20] == 0
+        year, month, day, hour, minute, second = [
+            digits[:, i] * 10 + digits[:, i+1] for i in (0, 5, 8, 11, 14, 17)]
+        year = year * 100 + digits[:, 2] * 10 + digits[:, 3]
+        months = np.where(fast, (year - 1970) * 12 + month - 1, 0)
+        first = months.astype('datetime64[M]').astype('datetime64[D]')
+        length = (months + 1).astype('datetime64[M]').astype(
+                  'datetime64[D]') - first
+        fast &= ((month >= 1) & (month <= 12) & (day >= 1)
+                 & (day <= length.astype(int)) & (hour <= 23)
+                 & (minute <= 59) & (second <= 60))
+        days = first.astype(np.int64) + day - 1
+        result[fast] = (days * 86400 + 3600 * hour + 60 * minute
+                        + second)[fast]
+    for i in np.flatnonzero(~fast):
+        result[i] = parse_time(time_strings[i])
+    return result
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Per-stage timing counters for parsing, distances and segmentation
+
+    A Profile records, for every instrumented stage, the number of calls, the
+    cumulative wall time and the number of trackpoints processed, and
+    optionally a histogram of the number of Vincenty iterations. It is used
+    as a context manager:
+
+    >>> with Profile() as profile:
+    ...     run = Run('run.gpx')
+    ...     run.segmentize()
+    >>> print profile
+
+    While a profile is active, the instrumented functions are replaced by
+    wrappers; afterwards, the original functions are restored. Without an
+    active profile, the instrumentation costs nothing. Stages may be nested
+    (e.g. step distances within segmentize), in which case the time of the
+    outer stage includes the time of the inner one, and the overhead of the
+    wrappers. Worker processes of Batch.analyze are not profiled.
+
+    If count_iterations is True, the number of iterations of every Vincenty
+    calculation is added to a histogram. The counts are reported by the
+    calculations themselves, through Distance.ITERATION_COUNTER, so they are
+    those of the calls that are being timed, both of the vectorized kernel
+    and of Trackpoint.distance_to. Most steps of a track converge after 2 or
+    3 iterations. The last bin counts the pairs of points for which the
+    iteration did not converge and which are taken as antipodal.
+"""
+
+import time
+import numpy as np
+
+from RunkeeperAnalyze import Distance, GPX_Parser, RunData
+from RunkeeperAnalyze.Distance import MAX_ITERATIONS
+
+# Profile that is currently active, if any
+ACTIVE_PROFILE = None
+
+
+def _length(args, result):
+    """ Number of points in the first argument """
+    return len(args[0])
+
+
+def _pair(args, result):
+    """ A single pair of points """
+    return 2
+
+
+def _one(args, result):
+    """ A single point """
+    return 1
+
+
+def _columns(args, result):
+    """ Number of points in the columns returned by read_columns """
+    return result[0].shape[1]
+
+
+def _segment(args, result):
+    """ Number of points in the segment given as first argument (or the
+        segment the method was called on)
+    """
+    return len(args[0].trackpoints)
+
+
+def _run(args, result):
+    """ Number of points in the run the method was called on """
+    return sum(len(segment.trackpoints) for segment in args[0].segments)
+
+
+# (owner, attribute, stage, function returning the number of points); the
+# same function may have to be replaced in several modules that imported it
+INSTRUMENTED = [
+    (GPX_Parser, 'read_columns', 'parse', _columns),
+    (RunData, 'read_columns', 'parse', _columns),
+    (GPX_Parser.GPX_Parser, 'next', 'parse (streaming)', _one),
+    (GPX_Parser, 'parse_time', 'timestamp decoding', _one),
+    (GPX_Parser.Trackpoint, 'distance_to', 'Trackpoint.distance_to', _pair),
+    (Distance, 'step_distances', 'step distances', _length),
+    (RunData, 'step_distances', 'step distances', _length),
+    (Distance, 'distances', 'distances', _length),
+    (RunData, 'distances', 'distances', _length),
+    (RunData.Segment, 'total_distance', 'Segment aggregates', _segment),
+    (RunData.Segment, 'average_speed', 'Segment aggregates', _segment),
+    (RunData.Segment, 'average_pace', 'Segment aggregates', _segment),
+    (RunData.Run, 'total_distance', 'Run aggregates', _run),
+    (RunData.Run, 'active_distance', 'Run aggregates', _run),
+    (RunData.Run, 'skipped_distance', 'Run aggregates', _run),
+    (RunData.Run, 'average_speed', 'Run aggregates', _run),
+    (RunData.Run, 'average_pace', 'Run aggregates', _run),
+    (RunData, 'segmentize', 'segmentize', _segment),
+]
+
+class Stage(object):
+    """ Counters for a single stage: number of calls, cumulative wall time in
+        seconds, and number of trackpoints processed
+    """
+    __slots__ = ('calls', 'seconds', 'points')
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.points = 0
+
+
+class Profile(object):
+    """ Class for collecting timing counters (see module documentation)
+
+        stages maps stage names to Stage instances. If count_iterations is
+        True, iterations is a histogram of the Vincenty iterations:
+        iterations[i] is the number of pairs of points that needed i
+        iterations. The last entry counts the pairs for which the iteration
+        gave up and fell back to antipodal points.
+    """
+    def __init__(self, count_iterations=False):
+        self.count_iterations = count_iterations
+        self.stages = {}
+        self.iterations = np.zeros(MAX_ITERATIONS + 2, dtype=int)
+        self.seconds = 0.0
+        self._originals = []
+        self._start = None
+    def __enter__(self):
+        self.enable()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+        return False
+    def enable(self):
+        """ Start recording """
+        global ACTIVE_PROFILE
+        if ACTIVE_PROFILE is not None:
+            raise RuntimeError("another profile is already active")
+        ACTIVE_PROFILE = self
+        for owner, name, stage, points in INSTRUMENTED:
+            self._replace(owner, name, self._timed(vars(owner)[name], stage,
+                                                   points))
+        if self.count_iterations:
+            self._replace(Distance, 'ITERATION_COUNTER', self._count)
+        self._start = time.time()
+    def disable(self):
+        """ Stop recording, and restore the original functions """
+        global ACTIVE_PROFILE
+        if ACTIVE_PROFILE is not self:
+            return
+        self.seconds += time.time() - self._start
+        for owner, name, original in reversed(self._originals):
+            setattr(owner, name, original)
+        self._originals = []
+        ACTIVE_PROFILE = None
+    def _replace(self, owner, name, function):
+        """ Replace the given attribute of owner by function """
+        self._originals.append((owner, name, vars(owner)[name]))
+        setattr(owner, name, function)
+    def _timed(self, function, stage, points):
+        """ Return wrapper around function that records calls, time and
+            points in the given stage
+        """
+        counters = self.stages.setdefault(stage, Stage())
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                counters.seconds += time.time() - start
+                counters.calls += 1
+            counters.points += points(args, result)
+            return result
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    def _count(self, iterations):
+        """ Add the Vincenty iterations reported by Distance._inverse (an
+            array) or Trackpoint.distance_to (an int) to the histogram
+        """
+        if isinstance(iterations, np.ndarray):
+            self.iterations += np.bincount(iterations,
+                                           minlength=len(self.iterations))
+        else:
+            self.iterations[iterations] += 1
+    def antipodal_fallbacks(self):
+        """ Return how often the Vincenty iteration gave up """
+        return int(self.iterations[-1])
+    def report(self):
+        """ Return a dict with all counters, suitable for e.g. json """
+        return {'seconds': self.seconds,
+                'stages': dict((name, {'calls': stage.calls,
+                                       'seconds': stage.seconds,
+                                       'points': stage.points})
+                               for (name, stage) in self.stages.items()
+                               if stage.calls > 0),
+                'vincenty_iterations': dict((i, int(count)) for (i, count)
+                                   in enumerate(self.iterations) if count > 0),
+                'antipodal_fallbacks': self.antipodal_fallbacks()}
+    def __str__(self):
+        lines = ["%-24s %10s %10s %12s %12s" % ("stage", "calls", "time (s)",
+                                                "points", "points/s")]
+        for name, stage in sorted(self.stages.items(),
+                                  key=lambda item: -item[1].seconds):
+            if stage.calls == 0:
+                continue
+            rate = stage.points / max(stage.seconds, 1e-9)
+            lines.append("%-24s %10i %10.3f %12i %12.0f" % (name,
+                         stage.calls, stage.seconds, stage.points, rate))
+        lines.append("total time: %.3f s" % self.seconds)
+        counted = self.iterations.sum()
+        if counted > 0:
+            lines.append("Vincenty iterations: %s" % ", ".join(
+                         "%i: %i" % (i, count) for (i, count)
+                         in enumerate(self.iterations) if count > 0))
+            lines.append("antipodal fallbacks: %i of %i"
+                         % (self.antipodal_fallbacks(), counted))
+        return "\n".join(lines)
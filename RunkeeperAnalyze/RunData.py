@@ -21,124 +21,689 @@
 
 """ Classes containing Run Data """
 
-from RunkeeperAnalyze.GPX_Parser import GPX_Parser, PREF_DUNIT
+import numpy as np
+
+from RunkeeperAnalyze import Distance, Cache
+from RunkeeperAnalyze.GPX_Parser import GPX_Index, Trackpoint, PREF_DUNIT, \
+                                         TIMES, DISTANCE, read_columns
+from RunkeeperAnalyze.Distance import distances, step_distances, cartesian
 
 WALKING_SPEED = 1.8 # [m/s] running if faster, walking if slower
 PAUSE_TIME = 60 # secs of walking indicating a break (new segment)
 
-class Segment:
-    """ Class that represents on Run segment """
+# rows of the data array of a Segment
+COLUMNS = ('latitude', 'longitude', 'elevation', 'timestamp')
+LATITUDE, LONGITUDE, ELEVATION, TIMESTAMP = range(len(COLUMNS))
+
+class _VersionCounter(object):
+    """ Source of the version numbers that identify the state of a Segment.
+        latest is the number handed out last, so any change to any segment
+        since a given version can be detected in constant time.
+    """
     def __init__(self):
-        self.trackpoints = []
-    def total_distance(self, unit='meter'):
+        self.latest = -1
+    def next(self):
+        self.latest += 1
+        return self.latest
+
+_versions = _VersionCounter()
+
+
+def _view_property(row):
+    """ Return property that accesses the given row of the data of the
+        segment a TrackpointView belongs to
+    """
+    def fget(self):
+        return float(self._segment._data[row, self._index])
+    def fset(self, value):
+        self._segment._data[row, self._index] = value
+        self._segment.changed()
+    return property(fget, fset)
+
+
+class TrackpointView(Trackpoint):
+    """ Trackpoint that does not hold any data itself, but reads and writes
+        the data of a point stored in a Segment
+    """
+    __slots__ = ('_segment', '_index')
+    latitude = _view_property(LATITUDE)
+    longitude = _view_property(LONGITUDE)
+    elevation = _view_property(ELEVATION)
+    timestamp = _view_property(TIMESTAMP)
+    def __init__(self, segment, index):
+        self._segment = segment
+        self._index = index
+
+
+class TrackpointList(object):
+    """ List-like access to the trackpoints of a Segment. Items are
+        TrackpointView instances.
+    """
+    def __init__(self, segment):
+        self._segment = segment
+    def __len__(self):
+        return self._segment._size
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TrackpointView(self._segment, i)
+                    for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trackpoint index out of range")
+        return TrackpointView(self._segment, index)
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield TrackpointView(self._segment, i)
+    def append(self, trackpoint):
+        """ Append a copy of the given trackpoint to the segment """
+        self._segment.append(trackpoint)
+    def extend(self, trackpoints):
+        """ Append copies of all the given trackpoints to the segment """
+        for trackpoint in trackpoints:
+            self._segment.append(trackpoint)
+    def __iadd__(self, trackpoints):
+        self.extend(trackpoints)
+        return self
+
+
+class Segment(object):
+    """ Class that represents on Run segment
+
+        The data of all trackpoints is stored in a single float array of shape
+        (4, n), with one contiguous row for each of the COLUMNS. The
+        trackpoints attribute gives access to the individual points as
+        Trackpoint instances.
+
+        Step distances and cumulative distances are calculated only once and
+        are cached until the data changes through the methods of the segment,
+        its trackpoints, or their attributes. After writing to the arrays
+        returned by the data, latitude, longitude, elevation or timestamp
+        attributes directly, changed() must be called.
+    """
+    def __init__(self, data=None):
+        """ Create a segment, optionally from an existing data array. The
+            segment uses the given array directly, without making a copy
+        """
+        if data is None:
+            data = np.empty((len(COLUMNS), 0))
+        self._data = data
+        self._size = data.shape[1]
+        self._cache = {}
+        self._version = _versions.next()
+    @classmethod
+    def from_trackpoints(cls, trackpoints):
+        """ Create a segment holding a copy of the data in the given list of
+            trackpoints
+        """
+        data = np.array([(tp.latitude, tp.longitude, tp.elevation,
+                          tp.timestamp) for tp in trackpoints], dtype=float)
+        return cls(np.ascontiguousarray(data.reshape(-1, len(COLUMNS)).T))
+    def _get_trackpoints(self):
+        return TrackpointList(self)
+    def _set_trackpoints(self, trackpoints):
+        if isinstance(trackpoints, TrackpointList) \
+        and trackpoints._segment is self:
+            return # result of augmented assignment
+        data = Segment.from_trackpoints(trackpoints)._data
+        self._data = data
+        self._size = data.shape[1]
+        self.changed()
+    trackpoints = property(_get_trackpoints, _set_trackpoints)
+    @property
+    def data(self):
+        """ Array of shape (4, n) containing the data of all trackpoints """
+        return self._data[:, :self._size]
+    @property
+    def latitude(self):
+        """ Array of the latitudes of all trackpoints """
+        return self._data[LATITUDE, :self._size]
+    @property
+    def longitude(self):
+        """ Array of the longitudes of all trackpoints """
+        return self._data[LONGITUDE, :self._size]
+    @property
+    def elevation(self):
+        """ Array of the elevations of all trackpoints """
+        return self._data[ELEVATION, :self._size]
+    @property
+    def timestamp(self):
+        """ Array of the timestamps of all trackpoints """
+        return self._data[TIMESTAMP, :self._size]
+    def append(self, trackpoint):
+        """ Append a copy of the given trackpoint to the segment """
+        if self._size == self._data.shape[1]:
+            data = np.empty((len(COLUMNS), max(16, 2 * self._size)))
+            data[:, :self._size] = self.data
+            self._data = data
+        self._data[:, self._size] = (trackpoint.latitude,
+                                     trackpoint.longitude,
+                                     trackpoint.elevation,
+                                     trackpoint.timestamp)
+        self._size += 1
+        self.changed()
+    def changed(self):
+        """ Discard all cached distances. This is called whenever the
+            trackpoint data is modified through the segment; call it after
+            writing to the data arrays directly.
+        """
+        self._cache = {}
+        self._version = _versions.next()
+    def _step_distances(self, use_elevation, model):
+        """ Return cached array of the step distances in meters """
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        key = ('step', use_elevation, model)
+        if key not in self._cache:
+            if use_elevation:
+                self._cache[key] = step_distances(self.latitude,
+                                   self.longitude, self.elevation, model=model)
+            else:
+                self._cache[key] = step_distances(self.latitude,
+                                   self.longitude, model=model)
+        return self._cache[key]
+    def _cumulative_distance(self, use_elevation, model):
+        """ Return cached array of the cumulative distances in meters """
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        key = ('cumulative', use_elevation, model)
+        if key not in self._cache:
+            result = np.zeros(self._size)
+            np.cumsum(self._step_distances(use_elevation, model),
+                      out=result[1:])
+            self._cache[key] = result
+        return self._cache[key]
+    def step_distances(self, use_elevation=True, unit='meter', model=None):
+        """ Return array of the distances between consecutive trackpoints,
+            calculated with the given distance model (default
+            Distance.DISTANCE_MODEL)
+        """
+        return self._step_distances(use_elevation, model) / DISTANCE[unit]
+    def cumulative_distance(self, use_elevation=True, unit='meter',
+                            model=None):
+        """ Return array of the distances covered from the first trackpoint up
+            to every trackpoint
+        """
+        return self._cumulative_distance(use_elevation, model) \
+               / DISTANCE[unit]
+    def cumulative_time(self, unit='sec'):
+        """ Return array of the time elapsed from the first trackpoint up to
+            every trackpoint
+        """
+        return (self.timestamp - self.timestamp[0]) / TIMES[unit]
+    def distance_between(self, i, j, use_elevation=True, unit='meter',
+                         model=None):
+        """ Return the distance covered between the trackpoints with indices
+            i and j
+        """
+        cumulative = self._cumulative_distance(use_elevation, model)
+        return abs(cumulative[j] - cumulative[i]) / DISTANCE[unit]
+    def time_between(self, i, j, unit='sec'):
+        """ Return the time elapsed between the trackpoints with indices i and
+            j
+        """
+        return abs(self.timestamp[j] - self.timestamp[i]) / TIMES[unit]
+    def total_distance(self, unit='meter', model=None):
         """ Return the total distance covered in the segment
         """
-        result = 0
-        for i in xrange(1, len(self.trackpoints)):
-            result = result + self.trackpoints[i].distance_to(
-                              self.trackpoints[i-1], unit=unit)
-        return result
+        if self._size == 0:
+            return 0.0
+        return self._cumulative_distance(True, model)[-1] / DISTANCE[unit]
     def total_time(self, unit='sec'):
         """ Return the total time the segment took """
-        return self.trackpoints[0].time_to(self.trackpoints[-1], unit=unit)
-    def average_speed(self, dunit=PREF_DUNIT, tunit='hour'):
+        timestamp = self.timestamp
+        return abs(timestamp[-1] - timestamp[0]) / TIMES[unit]
+    def average_speed(self, dunit=PREF_DUNIT, tunit='hour', model=None):
         """ Return the average speed over the segment """
-        return self.total_distance(unit=dunit) / self.total_time(unit=tunit)
-    def average_pace(self, tunit='min', dunit=PREF_DUNIT):
+        return self.total_distance(unit=dunit, model=model) \
+               / self.total_time(unit=tunit)
+    def average_pace(self, tunit='min', dunit=PREF_DUNIT, model=None):
         """ Return the average speed over the segment """
-        return  self.total_time(unit=tunit) / self.total_distance(unit=dunit)
+        return  self.total_time(unit=tunit) \
+                / self.total_distance(unit=dunit, model=model)
+    def _distance_error(self, segment, model):
+        """ Return the total distance of the segment minus that of the given
+            segment, in meters
+        """
+        return self.total_distance(model=model) \
+               - segment.total_distance(model=model)
+    def simplify(self, tolerance, model=None):
+        """ Simplify the segment with the Douglas-Peucker algorithm: keep
+            only the trackpoints needed so that no trackpoint is further than
+            tolerance (in meters) away from the new track. Return a tuple
+            (segment, error), where segment is a new segment holding a copy
+            of the kept trackpoints, and error is the total distance in
+            meters lost by the simplification (using the given model).
+        """
+        if self._size < 3:
+            segment = Segment(self.data.copy())
+            return segment, 0.0
+        xyz = cartesian(self.latitude, self.longitude)
+        keep = np.zeros(self._size, dtype=bool)
+        keep[0] = keep[-1] = True
+        stack = [(0, self._size - 1)]
+        while stack:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+            direction = xyz[:, last:last+1] - xyz[:, first:first+1]
+            offset = xyz[:, first+1:last] - xyz[:, first:first+1]
+            length2 = (direction**2).sum()
+            if length2 > 0:
+                # distance to the line segment between first and last
+                t = np.clip((offset * direction).sum(axis=0) / length2,
+                            0.0, 1.0)
+                offset = offset - t * direction
+            offset2 = (offset**2).sum(axis=0)
+            i = int(np.argmax(offset2))
+            if offset2[i] > tolerance**2:
+                keep[first + 1 + i] = True
+                stack.append((first, first + 1 + i))
+                stack.append((first + 1 + i, last))
+        segment = Segment(self.data[:, keep])
+        return segment, self._distance_error(segment, model)
+    def resample(self, time_step=None, distance_step=None, model=None):
+        """ Resample the segment at fixed time steps (in seconds), or at fixed
+            distance steps (in meters, using the given model). Positions,
+            elevations and timestamps are interpolated linearly. The first
+            and last trackpoint are always kept. Return a tuple (segment,
+            error), where segment is the new segment, and error is the total
+            distance in meters lost by the resampling.
+        """
+        if (time_step is None) == (distance_step is None):
+            raise ValueError("give either time_step or distance_step")
+        if self._size < 2:
+            segment = Segment(self.data.copy())
+            return segment, 0.0
+        if time_step is not None:
+            position = self.timestamp
+            step = time_step
+        else:
+            position = self._cumulative_distance(True, model)
+            step = distance_step
+        if step <= 0:
+            raise ValueError("step must be positive")
+        # for np.interp, positions must be increasing: keep only the points
+        # beyond all earlier positions
+        increasing = np.ones(self._size, dtype=bool)
+        increasing[1:] = (position[1:]
+                          > np.maximum.accumulate(position)[:-1])
+        position = position[increasing]
+        new_position = np.arange(position[0], position[-1], step)
+        new_position = np.append(new_position, position[-1])
+        longitude = np.unwrap(self.longitude[increasing]
+                              * 0.0174532925199433) / 0.0174532925199433
+        data = np.empty((len(COLUMNS), len(new_position)))
+        data[LATITUDE] = np.interp(new_position, position,
+                                   self.latitude[increasing])
+        data[LONGITUDE] = (np.interp(new_position, position, longitude)
+                           + 180.0) % 360.0 - 180.0
+        data[ELEVATION] = np.interp(new_position, position,
+                                    self.elevation[increasing])
+        data[TIMESTAMP] = np.interp(new_position, position,
+                                    self.timestamp[increasing])
+        segment = Segment(data)
+        return segment, self._distance_error(segment, model)
 
 
 class Run:
     """ Class that represents a Run
+
+        Distances are cached as long as the segments (and their data) stay the
+        same.
     """
-    def __init__(self, filename=None):
-        """ Create a Run from a gpx file"""
+    def __init__(self, filename=None, track=0, index=None):
+        """ Create a Run from the given track of a gpx file (default: the
+            first one). If the GPX_Index of the file is given, the file is not
+            read again (see read_index).
+        """
         self.filename = filename
         self.segments = []
-        self._parser = None
+        self._cache = {}
+        self._cache_key = None
         if filename is not None:
-            self._parser = GPX_Parser(filename)
-            for seg in xrange(self._parser.number_of_segments()):
-                self.segments.append(Segment())
-                for trackpoint in self._parser:
-                    self.segments[seg].trackpoints.append(trackpoint)
+            if index is None:
+                index = read_index(filename)
+            for i in xrange(index.number_of_segments(track)):
+                self.segments.append(Segment(index.segment_data(track, i)))
+    def columns(self):
+        """ Return a tuple (data, offsets), where data is an array of shape
+            (4, n) holding the data of all trackpoints in the run, and
+            segment i consists of the columns offsets[i]:offsets[i+1]
+        """
+        sizes = [segment.data.shape[1] for segment in self.segments]
+        offsets = np.zeros(len(sizes) + 1, dtype=int)
+        offsets[1:] = np.cumsum(sizes)
+        if self.segments:
+            data = np.concatenate([segment.data for segment in self.segments],
+                                  axis=1)
+        else:
+            data = np.empty((len(COLUMNS), 0))
+        return data, offsets
+    def _get_cache(self):
+        """ Return dict of cached values, which is emptied whenever the
+            segments have changed
+        """
+        key = tuple(segment._version for segment in self.segments)
+        if key != self._cache_key:
+            self._cache = {}
+            self._cache_key = key
+        return self._cache
     def pause_time(self, unit='sec'):
         """ Return the total number of seconds not spent running (i.e. time
             spent between segments)
         """
         result = 0
         for i in xrange(1, len(self.segments)):
-            result = result + self.segments[i].trackpoints[0].time_to(
-                     self.segments[i-1].trackpoints[-1], unit=unit)
-        return result
-    def skipped_distance(self, unit='meter'):
+            result = result + abs(self.segments[i].timestamp[0]
+                                  - self.segments[i-1].timestamp[-1])
+        return result / TIMES[unit]
+    def skipped_distance(self, unit='meter', model=None):
         """ Return the total distance not spent running (i.e.  distance skipped
             between segments)
         """
-        result = 0
-        for i in xrange(1, len(self.segments)):
-            result = result + self.segments[i].trackpoints[0].distance_to(
-                     self.segments[i-1].trackpoints[-1], unit=unit)
-        return result
-    def total_distance(self, unit='meter'):
+        if len(self.segments) < 2:
+            return 0
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        cache = self._get_cache()
+        if ('skipped', model) not in cache:
+            first = np.array([segment.data[:, 0]
+                              for segment in self.segments[1:]]).T
+            last = np.array([segment.data[:, -1]
+                             for segment in self.segments[:-1]]).T
+            surface_distance = distances(first[LATITUDE], first[LONGITUDE],
+                                         last[LATITUDE], last[LONGITUDE],
+                                         model=model)
+            distance = np.sqrt(surface_distance**2
+                               + (first[ELEVATION] - last[ELEVATION])**2)
+            cache[('skipped', model)] = distance.sum()
+        return cache[('skipped', model)] / DISTANCE[unit]
+    def total_distance(self, unit='meter', model=None):
         """ Return the total distance covered in the run, including inactive
             periods
         """
-        return self.active_distance(unit=unit) \
-               + self.skipped_distance(unit=unit)
+        return self.active_distance(unit=unit, model=model) \
+               + self.skipped_distance(unit=unit, model=model)
     def total_time(self, unit='sec'):
         """ Return the total time the run took """
-        return self.segments[0].trackpoints[0].time_to(
-               self.segments[-1].trackpoints[-1], unit=unit)
-    def active_distance(self, unit='meter'):
+        return abs(self.segments[-1].timestamp[-1]
+                   - self.segments[0].timestamp[0]) / TIMES[unit]
+    def active_distance(self, unit='meter', model=None):
         """ Return the total distance covered in the run """
-        result = 0
-        for segment in self.segments:
-            result = result + segment.total_distance(unit=unit)
-        return result
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        cache = self._get_cache()
+        if ('active', model) not in cache:
+            result = 0
+            for segment in self.segments:
+                result = result + segment.total_distance(model=model)
+            cache[('active', model)] = result
+        return cache[('active', model)] / DISTANCE[unit]
     def active_time(self, unit='second'):
         """ Return the total distance covered in the run """
         return self.total_time(unit=unit) - self.pause_time(unit=unit)
-    def average_speed(self, dunit=PREF_DUNIT, tunit='hour'):
+    def average_speed(self, dunit=PREF_DUNIT, tunit='hour', model=None):
         """ Return the average speed over active periods """
-        return self.active_distance(unit=dunit) / self.active_time(unit=tunit)
-    def average_pace(self, tunit='min', dunit=PREF_DUNIT):
+        return self.active_distance(unit=dunit, model=model) \
+               / self.active_time(unit=tunit)
+    def average_pace(self, tunit='min', dunit=PREF_DUNIT, model=None):
         """ Return the average speed over active periods """
-        return  self.active_time(unit=tunit) / self.active_distance(unit=dunit)
-    def segmentize(self):
-        """ Create segments based on heuristics """
+        return  self.active_time(unit=tunit) \
+                / self.active_distance(unit=dunit, model=model)
+    def segmentize(self, walking_speed=WALKING_SPEED, pause_time=PAUSE_TIME,
+                   model=None):
+        """ Create segments based on heuristics (see segmentize function) """
         segments = self.segments
         self.segments = []
         for segment in segments:
-            self.segments += segmentize(segment)
-
-
-def segmentize(segment, walking_speed=WALKING_SPEED, pause_time=PAUSE_TIME):
-    """ Split on segment into several, return array of segments """
-    result = [Segment(),]
-    marked_trackpoint = segment.trackpoints[0]
-    result[-1].trackpoints.append(marked_trackpoint)
-    in_segment = True
-    tp_buffer = [] # buffer for trackpoints we're undecided about
-    for i in xrange(1, len(segment.trackpoints)):
-        if (segment.trackpoints[i].speed_to(segment.trackpoints[i-1],
-        dunit='meter', tunit='sec') > walking_speed):
-            marked_trackpoint = segment.trackpoints[i]
-            in_segment = True
-            result[-1].trackpoints += tp_buffer
-            tp_buffer = []
-            result[-1].trackpoints.append(marked_trackpoint)
-        else: # we're walking ...
-            if (marked_trackpoint.time_to(segment.trackpoints[i])
-            > pause_time):
-                # ... for longer than is acceptable
-                tp_buffer = []
-                if in_segment:
-                    result.append(Segment())
-                    in_segment = False
+            self.segments += segmentize(segment, walking_speed, pause_time,
+                                        model)
+    def _transformed(self, transform):
+        """ Return a tuple (run, error) for a new run whose segments are
+            the result of the given transform of every segment (a function
+            returning a tuple (segment, error)), and the sum of the errors.
+        """
+        run = Run()
+        run.filename = self.filename
+        error = 0.0
+        for segment in self.segments:
+            new_segment, segment_error = transform(segment)
+            run.segments.append(new_segment)
+            error += segment_error
+        return run, error
+    def simplify(self, tolerance, model=None):
+        """ Simplify all segments (see Segment.simplify). Return a tuple
+            (run, error), where run is a new Run, and error is the active
+            distance in meters lost by the simplification
+        """
+        return self._transformed(
+               lambda segment: segment.simplify(tolerance, model=model))
+    def resample(self, time_step=None, distance_step=None, model=None):
+        """ Resample all segments (see Segment.resample). Return a tuple
+            (run, error), where run is a new Run, and error is the active
+            distance in meters lost by the resampling
+        """
+        return self._transformed(
+               lambda segment: segment.resample(time_step, distance_step,
+                                                model=model))
+
+
+def read_index(filename):
+    """ Return the GPX_Index for the given gpx file. If Cache.TRACK_CACHE is
+        set, the index is taken from the cache or stored in it.
+    """
+    cache = Cache.TRACK_CACHE
+    columns = None
+    if cache is not None:
+        columns = cache.load(filename)
+    if columns is None:
+        columns = read_columns(filename)
+        if cache is not None:
+            cache.store(filename, *columns)
+    return GPX_Index(filename, columns)
+
+
+def read_runs(filename):
+    """ Generator for a Run for every track in the given gpx file. The file
+        is read only once, and every Run is created when it is requested.
+    """
+    index = read_index(filename)
+    for track in xrange(index.number_of_tracks()):
+        yield Run(filename, track, index)
+
+
+class LiveRun(Run):
+    """ Class that represents a Run that is built up one trackpoint at a
+        time, e.g. while it is still in progress
+
+        Every appended trackpoint is segmentized immediately, with the same
+        heuristic as the segmentize function (applied to all trackpoints as a
+        single segment). Only the trackpoints whose fate is still undecided
+        are buffered. The active distance, skipped distance and pause time
+        are kept up to date for the distance model given on creation, so
+        appending a trackpoint and querying the totals take constant time
+        (as long as no other segment is changed in between; otherwise, the
+        first query checks the versions of all segments once). If the
+        segments are modified directly, or a different model is requested,
+        the totals are calculated as for any Run, without the empty segment
+        that follows a pause.
+    """
+    def __init__(self, walking_speed=WALKING_SPEED, pause_time=PAUSE_TIME,
+                 model=None):
+        Run.__init__(self)
+        if model is None:
+            model = Distance.DISTANCE_MODEL
+        self.walking_speed = walking_speed
+        self.max_pause_time = pause_time
+        self.model = model
+        self._previous = None # last appended trackpoint
+        self._marked = None # last trackpoint reached at running speed
+        self._last = None # last trackpoint in the segments
+        self._in_segment = True
+        self._tp_buffer = [] # (trackpoint, step distance) not decided yet
+        self._active_distance = 0.0
+        self._skipped_distance = 0.0
+        self._pause_time = 0.0
+        self._version = _versions.latest # version after the last change
+        self._checked = _versions.latest # last version the totals were valid
+        self._segment_count = 0 # number of segments after the last change
+        self._nonempty = Run() # run without empty segments, for fallbacks
+    def append(self, trackpoint):
+        """ Append a copy of the given trackpoint to the run """
+        trackpoint = Trackpoint(trackpoint.latitude, trackpoint.longitude,
+                                trackpoint.timestamp, trackpoint.elevation)
+        if self._previous is None:
+            self._marked = trackpoint
+            self._keep(trackpoint, 0.0)
+        else:
+            step_distance = trackpoint.distance_to(self._previous,
+                                                   model=self.model)
+            step_time = trackpoint.time_to(self._previous)
+            if step_time > 0 \
+            and step_distance / step_time > self.walking_speed:
+                self._marked = trackpoint
+                self._in_segment = True
+                for buffered in self._tp_buffer:
+                    self._keep(*buffered)
+                self._tp_buffer = []
+                self._keep(trackpoint, step_distance)
+            else: # we're walking ...
+                if self._marked.time_to(trackpoint) > self.max_pause_time:
+                    # ... for longer than is acceptable
+                    self._tp_buffer = []
+                    if self._in_segment:
+                        self.segments.append(Segment())
+                        self._updated()
+                        self._in_segment = False
+                else:
+                    self._tp_buffer.append((trackpoint, step_distance))
+        self._previous = trackpoint
+    def extend(self, trackpoints):
+        """ Append copies of all the given trackpoints to the run. Any
+            iterable of trackpoints can be given, e.g. a GPX_Parser, which
+            yields the trackpoints of its next segment.
+        """
+        for trackpoint in trackpoints:
+            self.append(trackpoint)
+    def _keep(self, trackpoint, step_distance):
+        """ Append the trackpoint to the last segment, and update the totals.
+            step_distance is the distance from the previous trackpoint.
+        """
+        if not self.segments:
+            self.segments.append(Segment())
+        segment = self.segments[-1]
+        if self._last is not None:
+            if len(segment.trackpoints) == 0: # first point of a new segment
+                self._skipped_distance += trackpoint.distance_to(self._last,
+                                                             model=self.model)
+                self._pause_time += trackpoint.time_to(self._last)
             else:
-                tp_buffer.append(segment.trackpoints[i])
-    return result
+                self._active_distance += step_distance
+        segment.append(trackpoint)
+        self._updated()
+        self._last = trackpoint
+    def _updated(self):
+        """ Record the state of the segments after a change by the run """
+        self._version = self._checked = _versions.latest
+        self._segment_count = len(self.segments)
+    def _totals_valid(self, model):
+        """ Return True if the running totals can be used for the given model
+        """
+        if model is not None and model != self.model:
+            return False
+        if len(self.segments) != self._segment_count:
+            return False
+        if _versions.latest != self._checked:
+            # some segment has changed; any segment of this run that changed
+            # has a newer version than the last change by the run
+            for segment in self.segments:
+                if segment._version > self._version:
+                    return False
+            self._checked = _versions.latest
+        return True
+    def _without_empty_segments(self):
+        """ Return a Run with the same segments, except for empty ones """
+        self._nonempty.segments = [segment for segment in self.segments
+                                   if len(segment.trackpoints) > 0]
+        return self._nonempty
+    def pause_time(self, unit='sec'):
+        """ Return the total number of seconds not spent running (i.e. time
+            spent between segments)
+        """
+        if self._totals_valid(None):
+            return self._pause_time / TIMES[unit]
+        return self._without_empty_segments().pause_time(unit=unit)
+    def skipped_distance(self, unit='meter', model=None):
+        """ Return the total distance not spent running (i.e.  distance skipped
+            between segments)
+        """
+        if self._totals_valid(model):
+            return self._skipped_distance / DISTANCE[unit]
+        return self._without_empty_segments().skipped_distance(unit=unit,
+                                                               model=model)
+    def active_distance(self, unit='meter', model=None):
+        """ Return the total distance covered in the run """
+        if self._totals_valid(model):
+            return self._active_distance / DISTANCE[unit]
+        return self._without_empty_segments().active_distance(unit=unit,
+                                                              model=model)
+    def total_time(self, unit='sec'):
+        """ Return the total time the run took, up to the last trackpoint
+            in the segments
+        """
+        if self._totals_valid(None):
+            if self._last is None:
+                return 0.0
+            return abs(self._last.timestamp
+                       - self.segments[0].timestamp[0]) / TIMES[unit]
+        run = self._without_empty_segments()
+        if not run.segments:
+            return 0.0
+        return run.total_time(unit=unit)
 
 
+def segmentize(segment, walking_speed=WALKING_SPEED, pause_time=PAUSE_TIME,
+               model=None):
+    """ Split on segment into several, return array of segments
+
+        Trackpoints reached at more than walking_speed (in m/s) are "marked".
+        If the runner is slower than that for more than pause_time seconds
+        after a marked trackpoint, the segment ends at that marked trackpoint,
+        and the next segment starts with the first trackpoint after the last
+        one that exceeded pause_time. Trailing trackpoints after the last
+        marked one are dropped. If the segment ends with a pause, the result
+        ends with an empty segment.
+
+        The new segments are views on the data of the given segment.
+    """
+    if len(segment.trackpoints) == 0:
+        raise IndexError("cannot segmentize an empty segment")
+    if model is None:
+        model = Distance.DISTANCE_MODEL
+    timestamp = segment.timestamp
+    index = np.arange(len(timestamp))
+    step_distance = segment._step_distances(True, model)
+    step_time = np.abs(np.diff(timestamp))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(step_time == 0, 0.0, step_distance / step_time)
+    marked = np.ones(len(timestamp), dtype=bool)
+    marked[1:] = (speed > walking_speed)
+    marked_index = np.flatnonzero(marked)
+    last_marked = np.maximum.accumulate(np.where(marked, index, 0))
+    paused_index = np.flatnonzero(~marked & (np.abs(timestamp
+                                  - timestamp[last_marked]) > pause_time))
+    # group of every paused trackpoint: the index of the last marked
+    # trackpoint in marked_index
+    group = np.cumsum(marked)[paused_index] - 1
+    is_last = np.ones(len(group), dtype=bool)
+    is_last[:-1] = (group[1:] != group[:-1])
+    starts = np.concatenate(([0], paused_index[is_last] + 1))
+    ends = np.concatenate((marked_index[group[is_last]], marked_index[-1:]))
+    result = []
+    for start, end in zip(starts, ends):
+        result.append(Segment(segment.data[:, start:end+1]))
+        for key in (('step', True, model), ('step', False, model)):
+            if key in segment._cache: # share cached distances
+                result[-1]._cache[key] = segment._cache[key][start:end]
+    return result
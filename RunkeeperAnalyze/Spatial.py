@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Spatial index over the trackpoints of one or more runs
+
+    Trackpoints are projected onto a sphere in three-dimensional cartesian
+    coordinates, and sorted into a grid of cubic cells. This works the same
+    everywhere on earth, including the poles and the antimeridian. The grid
+    only selects candidates, using the straight-line distance through the
+    sphere, with a margin for the difference between the sphere and the
+    earth ellipsoid. The distances of the candidates are then calculated with
+    the given distance model (default Distance.DISTANCE_MODEL).
+"""
+
+import numpy as np
+
+from RunkeeperAnalyze import Distance
+from RunkeeperAnalyze.Distance import EARTH_MAJOR_AXIS, cartesian
+
+# relative margin between distances on the ellipsoid and on the sphere used
+# for the grid (the actual difference is below 0.7%)
+MARGIN = 0.01
+
+# if a query would have to look at more cells, all points are checked
+MAX_CELLS = 4096
+
+_BITS = 21 # bits per coordinate in the cell keys
+_OFFSET = 1 << (_BITS - 1)
+
+
+class SpatialMatch(object):
+    """ Class representing a trackpoint found in a SpatialIndex. name is the
+        name of the run it belongs to, segment and index identify the
+        trackpoint in the run. distance is the distance to the query point in
+        meters (None for bounding box queries).
+    """
+    __slots__ = ('name', 'segment', 'index', 'latitude', 'longitude',
+                 'distance')
+    def __init__(self, name, segment, index, latitude, longitude,
+                 distance=None):
+        self.name = name
+        self.segment = segment
+        self.index = index
+        self.latitude = latitude
+        self.longitude = longitude
+        self.distance = distance
+    def __str__(self):
+        result = "%s, segment %i, point %i (%s,%s)" % (self.name,
+                 self.segment, self.index, self.latitude, self.longitude)
+        if self.distance is not None:
+            result += ": %.1f m" % self.distance
+        return result
+
+
+class SpatialIndex(object):
+    """ Index over the trackpoints of any number of runs, supporting radius,
+        k-nearest and bounding box queries. Runs are identified by a name,
+        which defaults to their filename. The index is (re-)built on the first
+        query after runs have been added. Later changes to the runs are not
+        seen by the index.
+
+        cell_size is the edge length of the grid cells in meters, and should
+        be on the order of the typical query radius. It must be at least 10
+        meters.
+    """
+    def __init__(self, runs=(), cell_size=100.0):
+        if cell_size < 10.0:
+            raise ValueError("cell_size must be at least 10 meters")
+        self.cell_size = float(cell_size)
+        self.names = []
+        self._parts = [] # (latitude, longitude, run, segment, index) arrays
+        self._built = False
+        for run in runs:
+            self.add(run)
+    def add(self, run, name=None):
+        """ Add all trackpoints of the given run to the index """
+        if name is None:
+            name = run.filename
+        run_id = len(self.names)
+        self.names.append(name)
+        for segment_id, segment in enumerate(run.segments):
+            size = len(segment.trackpoints)
+            self._parts.append((np.array(segment.latitude, dtype=float),
+                                np.array(segment.longitude, dtype=float),
+                                np.zeros(size, dtype=int) + run_id,
+                                np.zeros(size, dtype=int) + segment_id,
+                                np.arange(size)))
+        self._built = False
+    def __len__(self):
+        return sum(len(part[0]) for part in self._parts)
+    def _build(self):
+        """ Sort all points by their cells, and by their latitude """
+        if self._built:
+            return
+        if self._parts:
+            columns = [np.concatenate(column) for column in zip(*self._parts)]
+        else:
+            columns = [np.empty(0), np.empty(0)] \
+                      + [np.empty(0, dtype=int)] * 3
+        xyz = cartesian(columns[0], columns[1])
+        keys = self._cell_keys(xyz)
+        order = np.argsort(keys, kind='mergesort')
+        self._keys = keys[order]
+        self._xyz = xyz[:, order]
+        (self._latitude, self._longitude, self._run, self._segment,
+         self._index) = [column[order] for column in columns]
+        self._latitude_order = np.argsort(self._latitude, kind='mergesort')
+        self._sorted_latitude = self._latitude[self._latitude_order]
+        self._built = True
+    def _cell_keys(self, xyz):
+        """ Return array of the keys of the cells containing the given points
+        """
+        cells = np.floor(xyz / self.cell_size).astype(np.int64) + _OFFSET
+        return (cells[0] << (2 * _BITS)) | (cells[1] << _BITS) | cells[2]
+    def _matches(self, selection, distance=None):
+        """ Return list of SpatialMatch instances for the points with the
+            given indices
+        """
+        if distance is None:
+            distance = [None] * len(selection)
+        return [SpatialMatch(self.names[self._run[i]], int(self._segment[i]),
+                             int(self._index[i]), float(self._latitude[i]),
+                             float(self._longitude[i]), d)
+                for (i, d) in zip(selection, distance)]
+    def _candidates(self, latitude, longitude, radius):
+        """ Return array of the indices of all points that may be within the
+            given radius (in meters) of the given point
+        """
+        center = cartesian(np.array([latitude], dtype=float),
+                           np.array([longitude], dtype=float))
+        reach = radius * (1 + MARGIN) # straight line, never longer than arc
+        steps = int(np.ceil(reach / self.cell_size))
+        if (2 * steps + 1)**3 > MAX_CELLS:
+            selection = np.arange(len(self._keys))
+        else:
+            shifts = np.arange(-steps, steps + 1) * self.cell_size
+            dx, dy, dz = np.meshgrid(shifts, shifts, shifts)
+            corners = center + np.array([dx.ravel(), dy.ravel(), dz.ravel()])
+            cell_keys = np.unique(self._cell_keys(corners))
+            starts = np.searchsorted(self._keys, cell_keys, side='left')
+            ends = np.searchsorted(self._keys, cell_keys, side='right')
+            ranges = [np.arange(start, end)
+                      for (start, end) in zip(starts, ends) if end > start]
+            if not ranges:
+                return np.empty(0, dtype=int)
+            selection = np.concatenate(ranges)
+        chord = np.sqrt(((self._xyz[:, selection] - center)**2).sum(axis=0))
+        return selection[chord <= reach]
+    def within(self, latitude, longitude, radius, model=None):
+        """ Return list of SpatialMatch instances for all trackpoints within
+            the given radius (in meters) of the given point, sorted by
+            distance
+        """
+        self._build()
+        selection = self._candidates(latitude, longitude, radius)
+        distance = Distance.distances(self._latitude[selection],
+                                      self._longitude[selection],
+                                      np.zeros(len(selection)) + latitude,
+                                      np.zeros(len(selection)) + longitude,
+                                      model=model)
+        inside = distance <= radius
+        selection, distance = selection[inside], distance[inside]
+        order = np.argsort(distance, kind='mergesort')
+        return self._matches(selection[order], distance[order])
+    def nearest(self, latitude, longitude, k=1, model=None):
+        """ Return list of SpatialMatch instances for the k trackpoints
+            closest to the given point, sorted by distance
+        """
+        self._build()
+        k = min(k, len(self._keys))
+        radius = self.cell_size
+        while True:
+            matches = self.within(latitude, longitude, radius, model=model)
+            if len(matches) >= k or radius > np.pi * EARTH_MAJOR_AXIS:
+                return matches[:k]
+            radius *= 4
+    def runs_within(self, latitude, longitude, radius, model=None):
+        """ Return sorted list of the names of all runs passing within the
+            given radius (in meters) of the given point
+        """
+        return sorted(set(match.name for match in
+                          self.within(latitude, longitude, radius, model)))
+    def bounding_box(self, min_latitude, min_longitude, max_latitude,
+                     max_longitude):
+        """ Return list of SpatialMatch instances for all trackpoints inside
+            the given bounding box (in degrees). If min_longitude is larger
+            than max_longitude, the box crosses the antimeridian.
+        """
+        self._build()
+        start = np.searchsorted(self._sorted_latitude, min_latitude, 'left')
+        end = np.searchsorted(self._sorted_latitude, max_latitude, 'right')
+        selection = self._latitude_order[start:end]
+        longitude = self._longitude[selection]
+        if min_longitude <= max_longitude:
+            inside = (longitude >= min_longitude) \
+                     & (longitude <= max_longitude)
+        else:
+            inside = (longitude >= min_longitude) \
+                     | (longitude <= max_longitude)
+        return self._matches(np.sort(selection[inside]))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#    Copyright (C) 2010 by Michael Goerz                                   #
+#    http://michaelgoerz.net                                               #
+#                                                                          #
+#    This program is free software; you can redistribute it and/or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOut ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Splits and best efforts of runs
+
+    All calculations use the active distance and active time of a run: the
+    distance covered and the time spent inside the segments. The gaps between
+    segments (see Run.pause_time and Run.skipped_distance) count neither as
+    distance nor as time. Between trackpoints, the runner is assumed to move
+    at constant speed.
+"""
+
+import numpy as np
+
+from RunkeeperAnalyze.GPX_Parser import PREF_DUNIT, TIMES, DISTANCE
+
+
+class Split(object):
+    """ Class representing one split of a run: the time in seconds needed for
+        the given distance (in meters). Only the last split of a run may be
+        shorter than the split unit.
+    """
+    __slots__ = ('distance', 'time')
+    def __init__(self, distance, time):
+        self.distance = distance
+        self.time = time
+    def __str__(self):
+        return "%.1f m in %.1f s" % (self.distance, self.time)
+    def pace(self, tunit='min', dunit=PREF_DUNIT):
+        """ Return the pace over the split in tunit/dunit """
+        return (self.time / TIMES[tunit]) / (self.distance / DISTANCE[dunit])
+
+
+class Effort(object):
+    """ Class representing the fastest time in which a run covered the given
+        distance (in meters). time is the active time in seconds, start and
+        end are the timestamps at the beginning and the end of the effort,
+        offset is the active distance in meters at which it started. name
+        identifies the run the effort belongs to.
+    """
+    __slots__ = ('distance', 'time', 'start', 'end', 'offset', 'name')
+    def __init__(self, distance, time, start, end, offset, name=None):
+        self.distance = distance
+        self.time = time
+        self.start = start
+        self.end = end
+        self.offset = offset
+        self.name = name
+    def __str__(self):
+        result = "%.1f m in %.1f s (from %.1f m)" % (self.distance,
+                                                      self.time, self.offset)
+        if self.name is not None:
+            result = "%s: %s" % (self.name, result)
+        return result
+    def pace(self, tunit='min', dunit=PREF_DUNIT):
+        """ Return the pace over the effort in tunit/dunit """
+        return (self.time / TIMES[tunit]) / (self.distance / DISTANCE[dunit])
+
+
+def active_track(run, model=None):
+    """ Return a tuple (distance, time, timestamp) of arrays for all
+        trackpoints of the run: the active distance in meters and the active
+        time in seconds up to every trackpoint, and its timestamp. The
+        distances are taken from the cache of the segments.
+    """
+    distances = []
+    times = []
+    timestamps = []
+    distance_offset = 0.0
+    time_offset = 0.0
+    for segment in run.segments:
+        if len(segment.trackpoints) == 0:
+            continue
+        cumulative = segment.cumulative_distance(model=model)
+        elapsed = np.zeros(len(cumulative))
+        np.cumsum(np.abs(np.diff(segment.timestamp)), out=elapsed[1:])
+        distances.append(cumulative + distance_offset)
+        times.append(elapsed + time_offset)
+        timestamps.append(segment.timestamp)
+        distance_offset += cumulative[-1]
+        time_offset += elapsed[-1]
+    if not distances:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    return (np.concatenate(distances), np.concatenate(times),
+            np.concatenate(timestamps))
+
+
+def _arrival_departure(distance):
+    """ Return a tuple (arrival, departure) of arrays of indices of
+        trackpoints. arrival contains the first trackpoint at every distance,
+        departure the last one, both with strictly increasing distance.
+    """
+    step = np.diff(distance) > 0
+    arrival = np.flatnonzero(np.concatenate(([True], step)))
+    departure = np.flatnonzero(np.concatenate((step, [True])))
+    return arrival, departure
+
+
+def splits(run, unit=PREF_DUNIT, model=None):
+    """ Return a list of Split instances, one for every unit of active
+        distance (e.g. every km), and one for the remaining distance (if
+        any). A split ends when the runner first reaches the split distance.
+    """
+    distance, time, timestamp = active_track(run, model)
+    if len(distance) == 0 or distance[-1] == 0:
+        return []
+    split_distance = DISTANCE[unit]
+    arrival = _arrival_departure(distance)[0]
+    boundaries = np.arange(split_distance, distance[-1], split_distance)
+    boundary_times = np.interp(boundaries, distance[arrival], time[arrival])
+    boundaries = np.concatenate(([0.0], boundaries, [distance[-1]]))
+    boundary_times = np.concatenate(([0.0], boundary_times, [time[-1]]))
+    return [Split(float(d), float(t)) for (d, t)
+            in zip(np.diff(boundaries), np.diff(boundary_times))]
+
+
+def best_efforts(run, distances, unit='meter', model=None, name=None):
+    """ Return a list of Effort instances with the fastest efforts of the run
+        for all the given distances (in the given unit), or None for
+        distances longer than the active distance of the run.
+
+        The best effort for a distance always starts or ends at a trackpoint.
+        Therefore, every trackpoint is tried as the start and as the end of
+        an effort, and the other end is interpolated, for all trackpoints at
+        once. The arrays are shared by all distances.
+    """
+    distance, time, timestamp = active_track(run, model)
+    arrival, departure = _arrival_departure(distance)
+    result = []
+    for target in distances:
+        target = target * DISTANCE[unit]
+        if len(distance) == 0 or target > distance[-1] or target <= 0:
+            result.append(None)
+            continue
+        # efforts starting at a trackpoint, ending in between
+        start = departure[distance[departure] <= distance[-1] - target]
+        start_offset = distance[start]
+        start_time = time[start]
+        end_time = np.interp(start_offset + target, distance[arrival],
+                             time[arrival])
+        # efforts ending at a trackpoint, starting in between
+        end = arrival[distance[arrival] >= target]
+        offset = np.concatenate((start_offset, distance[end] - target))
+        elapsed = np.concatenate((end_time - start_time, time[end]
+                                  - np.interp(distance[end] - target,
+                                              distance[departure],
+                                              time[departure])))
+        best = int(np.argmin(elapsed))
+        offset = float(offset[best])
+        start_timestamp = np.interp(offset, distance[departure],
+                                    timestamp[departure])
+        end_timestamp = np.interp(offset + target, distance[arrival],
+                                  timestamp[arrival])
+        result.append(Effort(target, float(elapsed[best]),
+                             float(start_timestamp), float(end_timestamp),
+                             offset, name))
+    return result
+
+
+def archive_best_efforts(runs, distances, unit='meter', model=None):
+    """ Return a list with the fastest Effort for each of the given distances
+        (in the given unit) across all the given runs, or None for distances
+        no run covered. The name of every effort is the filename of its run.
+    """
+    result = [None] * len(distances)
+    for run in runs:
+        efforts = best_efforts(run, distances, unit, model, run.filename)
+        for i, effort in enumerate(efforts):
+            if effort is not None \
+            and (result[i] is None or effort.time < result[i].time):
+                result[i] = effort
+    return result
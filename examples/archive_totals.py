@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+""" Print weekly or monthly totals for all runs in a directory of gpx files,
+    keeping the summaries in an archive file between calls
+"""
+
+import os
+import sys
+from RunkeeperAnalyze.Archive import Archive
+
+# Usage: archive_totals.py directory archive_file [day|week|month|year]
+
+path = sys.argv[1]
+archive_file = sys.argv[2]
+window = 'week'
+if len(sys.argv) > 3:
+    window = sys.argv[3]
+
+if os.path.isfile(archive_file):
+    archive = Archive.load(archive_file)
+else:
+    archive = Archive()
+analyzed = archive.update(path)
+if analyzed > 0:
+    archive.save(archive_file)
+print "%i run(s), %i analyzed now\n" % (len(archive), analyzed)
+
+for totals in archive.totals(window):
+    pace = totals.pace()
+    if pace is None:
+        print totals
+    else:
+        print "%s, %.2f min/km" % (totals, pace)
+trend = archive.pace_trend()
+if trend is not None:
+    print "\npace trend: %+.3f min/km per 30 days" % (30 * trend)
+for filename, error in sorted(archive.errors.items()):
+    print "%s: %s" % (filename, error)
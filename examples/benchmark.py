@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+""" Benchmark parsing, distance calculation, aggregates, segmentation and
+    export on synthetic gpx files
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import platform
+import tempfile
+import resource
+import multiprocessing
+from optparse import OptionParser
+import numpy as np
+from RunkeeperAnalyze import Cache, Export
+from RunkeeperAnalyze.Distance import MODELS
+from RunkeeperAnalyze.RunData import Run
+
+# Usage: benchmark.py [--quick] [--output results.json]
+#                     [--compare old_results.json]
+
+# name: (points, segments, pause pattern, start latitude, start longitude)
+CASES = {
+    'small':       (1000, 1, 'none', 52.5, 13.4),
+    'medium':      (10000, 1, 'regular', 52.5, 13.4),
+    'large':       (100000, 1, 'regular', 52.5, 13.4),
+    'many_pauses': (10000, 1, 'frequent', 52.5, 13.4),
+    'segments':    (10000, 20, 'regular', 52.5, 13.4),
+    'near_pole':   (10000, 1, 'regular', 89.99, 0.0),
+    'antimeridian': (10000, 1, 'regular', 0.0, 179.99),
+}
+QUICK_CASES = ('small', 'medium', 'near_pole', 'antimeridian')
+
+# probability of starting a pause at every point, and its length in seconds
+PAUSES = {'none': (0.0, 0), 'regular': (0.002, 120), 'frequent': (0.02, 90)}
+
+
+def write_gpx(filename, points, segments, pauses, latitude, longitude,
+              seed=0):
+    """ Write a synthetic gpx file. The track has the given number of points
+        in the given number of segments, starting at the given position. The
+        runner moves at about 3 m/s in a random walk, with one point per
+        second, and pauses according to the given pattern (key of PAUSES).
+        The same seed always gives the same file. Return the number of
+        points written.
+    """
+    rand = random.Random(seed)
+    pause_probability, pause_length = PAUSES[pauses]
+    timestamp = 1280000000
+    heading = 0.0
+    elevation = 50.0
+    written = 0
+    gpx_file = open(filename, 'w')
+    gpx_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<gpx version="1.1" creator="benchmark.py" '
+                   'xmlns="http://www.topografix.com/GPX/1/1">\n'
+                   '<trk><name>synthetic</name>\n')
+    for segment in xrange(segments):
+        gpx_file.write('<trkseg>\n')
+        for i in xrange(points // segments):
+            if rand.random() < pause_probability:
+                stop = timestamp + pause_length
+                while timestamp < stop: # standing, with GPS noise
+                    timestamp += 5
+                    written += 1
+                    gpx_file.write(_trkpt(latitude
+                                   + rand.gauss(0, 2e-6), longitude
+                                   + rand.gauss(0, 2e-6), elevation,
+                                   timestamp))
+            heading += rand.gauss(0, 0.2)
+            step = rand.uniform(2.5, 3.5) # meters
+            latitude += step * np.cos(heading) / 111000.0
+            longitude += step * np.sin(heading) \
+                         / (111000.0 * max(np.cos(np.radians(latitude)),
+                                           1e-3))
+            latitude = min(latitude, 89.9999)
+            longitude = (longitude + 180) % 360 - 180
+            elevation += rand.gauss(0, 0.3)
+            timestamp += 1
+            written += 1
+            gpx_file.write(_trkpt(latitude, longitude, elevation, timestamp))
+        gpx_file.write('</trkseg>\n')
+        timestamp += 300
+    gpx_file.write('</trk>\n</gpx>\n')
+    gpx_file.close()
+    return written
+
+
+def _trkpt(latitude, longitude, elevation, timestamp):
+    """ Return the trkpt element for a single point """
+    return ('<trkpt lat="%.7f" lon="%.7f"><ele>%.1f</ele>'
+            '<time>%s</time></trkpt>\n'
+            % (latitude, longitude, elevation,
+               time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))))
+
+
+def _peak_memory():
+    """ Return the peak memory of the current process in MB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _timed(results, stage, points, function):
+    """ Call function, and add the time, throughput and peak memory to the
+        results
+    """
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    results[stage] = {'seconds': seconds,
+                      'points_per_sec': points / max(seconds, 1e-9),
+                      'peak_memory_mb': _peak_memory()}
+
+
+def run_case(filename, points, queue):
+    """ Benchmark all stages for the given gpx file with the given number of
+        points, and put the results into the queue
+    """
+    results = {'points': points}
+    Cache.TRACK_CACHE = None
+    runs = []
+    _timed(results, 'parse', points, lambda: runs.append(Run(filename)))
+    run = runs[0]
+    def scalar_distances():
+        for segment in run.segments:
+            trackpoints = list(segment.trackpoints)
+            for i in xrange(1, len(trackpoints)):
+                trackpoints[i].distance_to(trackpoints[i-1],
+                                           model='vincenty')
+    _timed(results, 'distance_scalar_vincenty', points, scalar_distances)
+    for model in sorted(MODELS.keys()):
+        def step_distances():
+            for segment in run.segments:
+                segment.changed()
+                segment.step_distances(model=model)
+        _timed(results, 'distance_%s' % model, points, step_distances)
+    def aggregates():
+        run.total_distance()
+        run.average_speed()
+        run.average_pace()
+    for segment in run.segments:
+        segment.changed()
+    _timed(results, 'aggregates_cold', points, aggregates)
+    _timed(results, 'aggregates_warm', points, aggregates)
+    for segment in run.segments:
+        segment.changed() # segmentize has to compute the step distances
+    _timed(results, 'segmentize', points, run.segmentize)
+    for export_format in ('binary', 'csv'):
+        export_file = "%s.%s" % (filename, export_format)
+        write = getattr(Export, 'write_%s' % export_format)
+        read = getattr(Export, 'read_%s' % export_format)
+        _timed(results, 'export_%s' % export_format, points,
+               lambda: write([run], export_file))
+        _timed(results, 'import_%s' % export_format, points,
+               lambda: list(read(export_file)))
+    queue.put(results)
+
+
+def main(argv=None):
+    """ Main program """
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--quick', action='store_true', default=False,
+                      help="only run the small cases")
+    parser.add_option('--output', default='benchmark.json',
+                      help="file to write the results to")
+    parser.add_option('--compare',
+                      help="results of an earlier run to compare with")
+    options, args = parser.parse_args(argv)
+    cases = sorted(CASES.keys())
+    if options.quick:
+        cases = [case for case in cases if case in QUICK_CASES]
+    workdir = tempfile.mkdtemp()
+    report = {'date': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              'python': platform.python_version(),
+              'numpy': np.__version__, 'platform': platform.platform(),
+              'cases': {}}
+    try:
+        for case in cases:
+            filename = os.path.join(workdir, '%s.gpx' % case)
+            points = write_gpx(filename, *CASES[case])
+            # every case runs in a new process, for independent memory peaks
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_case,
+                                              args=(filename, points, queue))
+            process.start()
+            report['cases'][case] = queue.get()
+            process.join()
+            print "%s (%i points)" % (case, points)
+            for stage, result in sorted(report['cases'][case].items()):
+                if stage != 'points':
+                    print "    %-26s %8.3f s %12.0f points/s %8.1f MB" % (
+                          stage, result['seconds'], result['points_per_sec'],
+                          result['peak_memory_mb'])
+    finally:
+        shutil.rmtree(workdir)
+    output = open(options.output, 'w')
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.close()
+    if options.compare:
+        compare(json.load(open(options.compare)), report)
+    return 0
+
+
+def compare(old_report, new_report):
+    """ Print the speedup of all stages in new_report relative to
+        old_report
+    """
+    print "\nspeedup relative to %s:" % old_report['date']
+    for case, stages in sorted(new_report['cases'].items()):
+        if case not in old_report['cases']:
+            continue
+        for stage, result in sorted(stages.items()):
+            if stage != 'points' and stage in old_report['cases'][case]:
+                print "    %-14s %-26s %6.2f" % (case, stage,
+                      old_report['cases'][case][stage]['seconds']
+                      / max(result['seconds'], 1e-9))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
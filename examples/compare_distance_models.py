@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+""" Compare the distance models in RunkeeperAnalyze.Distance against the
+    Vincenty formula, for the tracks in the given gpx files, or for synthetic
+    tracks (see benchmark.py). Exit with status 1 if the worst relative
+    deviation of any model exceeds its bound in MAX_DEVIATION.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from benchmark import CASES, write_gpx
+from RunkeeperAnalyze import Cache
+from RunkeeperAnalyze.RunData import Run
+from RunkeeperAnalyze.Distance import MODELS
+
+# Usage: compare_distance_models.py [file1.gpx file2.gpx ...]
+
+# bounds for the relative deviation of steps of at least 1 m from the
+# vectorized Vincenty kernel; 'vincenty' is compared to the scalar
+# Trackpoint.distance_to. Measured: 1.1e-9 for 'vincenty', 5.64e-3 for the
+# spherical models (the flattening of the earth).
+MAX_DEVIATION = {'vincenty': 1e-8, 'haversine': 5.7e-3,
+                 'equirectangular': 5.7e-3}
+
+# synthetic tracks used without arguments: (points, segments, pauses,
+# start latitude, start longitude)
+SYNTHETIC = [CASES[case] for case in ('medium', 'near_pole', 'antimeridian')]
+SYNTHETIC += [(2000, 1, 'regular', latitude, 30.0)
+              for latitude in (-60.0, -30.0, 0.0, 30.0, 60.0)]
+
+
+def step_distances(segments, model):
+    """ Return concatenated step distances for all segments, and the time
+        needed to calculate them. Cached distances are discarded first.
+    """
+    for segment in segments:
+        segment.changed()
+    start = time.time()
+    result = [segment.step_distances(use_elevation=False, model=model)
+              for segment in segments]
+    return np.concatenate(result), time.time() - start
+
+
+def scalar_step_distances(segments):
+    """ Return concatenated step distances for all segments, from the scalar
+        Vincenty formula in Trackpoint.distance_to, and the time needed to
+        calculate them
+    """
+    start = time.time()
+    result = []
+    for segment in segments:
+        trackpoints = list(segment.trackpoints)
+        result.extend(trackpoints[i].distance_to(trackpoints[i-1],
+                                                 use_elevation=False,
+                                                 model='vincenty')
+                      for i in xrange(1, len(trackpoints)))
+    return np.array(result), time.time() - start
+
+
+def compare(filenames):
+    """ Print the deviations of all models for the given gpx files, and
+        return the list of models that exceed their bound
+    """
+    runs = [Run(filename) for filename in filenames]
+    segments = [segment for run in runs for segment in run.segments]
+    points = sum(len(segment.trackpoints) for segment in segments)
+    exact, exact_time = step_distances(segments, 'vincenty')
+    moving = exact > 1.0 # relative deviations for steps of at least 1 m
+    print "%i points in %i segments of %i runs\n" % (points, len(segments),
+                                                    len(runs))
+    print "%-16s %12s %12s %12s %10s %8s" % ("model", "max dev (m)",
+          "max rel dev", "total dev", "speedup", "")
+    failed = []
+    for model in sorted(MODELS.keys()):
+        if model == 'vincenty':
+            # the speedup is that of the kernel over the scalar formula
+            reference, reference_time = scalar_step_distances(segments)
+            approx, approx_time = exact, exact_time
+        else:
+            reference, reference_time = exact, exact_time
+            approx, approx_time = step_distances(segments, model)
+        deviation = np.abs(approx - reference)
+        worst = (deviation[moving] / reference[moving]).max()
+        status = "ok"
+        if worst > MAX_DEVIATION[model]:
+            status = "FAILED"
+            failed.append(model)
+        print "%-16s %12.3e %12.3e %12.3e %10.1f %8s" % (
+              model, deviation.max(), worst,
+              abs(approx.sum() - reference.sum()) / reference.sum(),
+              reference_time / approx_time, status)
+    return failed
+
+
+def main(argv=None):
+    """ Main program """
+    if argv is None:
+        argv = sys.argv[1:]
+    Cache.TRACK_CACHE = None
+    workdir = None
+    filenames = list(argv)
+    if not filenames:
+        workdir = tempfile.mkdtemp()
+        for i, case in enumerate(SYNTHETIC):
+            points, segments, pauses, latitude, longitude = case
+            filenames.append(os.path.join(workdir, 'synthetic%i.gpx' % i))
+            write_gpx(filenames[-1], points, segments, pauses, latitude,
+                      longitude, seed=i)
+    try:
+        failed = compare(filenames)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir)
+    if failed:
+        print "\nbound exceeded for %s" % ", ".join(failed)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+""" Print summaries for all runs in a directory of gpx files """
+
+import sys
+from RunkeeperAnalyze.Batch import analyze
+
+# Usage: summarize_runs.py directory [processes]
+
+path = sys.argv[1]
+processes = None
+if len(sys.argv) > 2:
+    processes = int(sys.argv[2])
+
+failed = 0
+for summary in analyze(path, processes=processes, chunksize=4):
+    print summary
+    if summary.error is not None:
+        failed += 1
+if failed > 0:
+    print "\n%i file(s) or track(s) could not be analyzed" % failed
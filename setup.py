@@ -9,5 +9,6 @@ setup(name='RunkeeperAnalyze',
       author_email='goerz@physik.fu-berlin.de',
       url='www.michaelgoerz.net',
       license='GPL',
-      packages=['RunkeeperAnalyze']
+      packages=['RunkeeperAnalyze'],
+      requires=['numpy']
      )